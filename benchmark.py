@@ -0,0 +1,230 @@
+"""Benchmark suite for conversation_suggester.py.
+
+Runs ConversationSuggester against a local mock Ollama server (see
+mock_ollama.py) over synthetic conversation histories of increasing size and
+reports startup/load time, per-turn persistence cost, prompt-build time,
+end-to-end latency percentiles and peak Python memory. Results are written as
+JSON so CI can compare a run against a stored baseline:
+
+    python benchmark.py --sizes 100,1000,10000 --output bench_results.json
+    python benchmark.py --baseline bench_baseline.json --tolerance 0.25
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from typing import Dict, List, Optional
+
+from rich.table import Table
+
+from conversation_suggester import ConversationSuggester, ShardedStore, console
+from mock_ollama import MockOllamaServer, WORDS
+
+PERSON = "Benchmark"
+OTHER_PEOPLE = 50  # Extra small conversations so the index is not trivially small
+MOOD, PERSONALITY, GENDER = "casual", "ambivert", "any"
+
+# Differences below these floors are treated as noise when comparing runs
+NOISE_FLOORS = {"_ms": 0.5, "_s": 0.005, "_mb": 1.0}
+
+def percentile(values: List[float], pct: float) -> float:
+    """Get the pct-th percentile of values using linear interpolation."""
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    position = (len(ordered) - 1) * pct / 100
+    lower = int(position)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
+
+def write_synthetic_history(data_dir: str, size: int, seed: int = 42):
+    """Write a conversation of size messages, plus a few small ones, to data_dir."""
+    rng = random.Random(seed)
+    store = ShardedStore(os.path.join(data_dir, "conversations"))
+    batch = []
+    for i in range(size):
+        words = [rng.choice(WORDS) for _ in range(rng.randint(4, 40))]
+        batch.append(f"{i}: {' '.join(words)}")
+        if len(batch) == 10000:
+            store.append(PERSON, batch)
+            batch = []
+    if batch:
+        store.append(PERSON, batch)
+    for n in range(OTHER_PEOPLE):
+        store.append(f"Person {n}", [f"hello from person {n}", "how are you?"])
+
+def timed(func, *args, **kwargs) -> tuple:
+    """Call func and return (result, elapsed seconds)."""
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+def ms(seconds: float) -> float:
+    return round(seconds * 1000, 3)
+
+def latency_metrics(prefix: str, samples: List[float]) -> Dict[str, float]:
+    """Summarize latency samples (in seconds) as millisecond percentiles."""
+    return {
+        f"{prefix}_p50_ms": ms(percentile(samples, 50)),
+        f"{prefix}_p95_ms": ms(percentile(samples, 95)),
+        f"{prefix}_p99_ms": ms(percentile(samples, 99)),
+        f"{prefix}_mean_ms": ms(statistics.fmean(samples)) if samples else 0.0
+    }
+
+def bench_size(size: int, server: MockOllamaServer, turns: int, context_tokens: int,
+               durability: str = "async") -> Dict[str, float]:
+    """Run every measurement against a fresh history of size messages."""
+    data_dir = tempfile.mkdtemp(prefix=f"bench-{size}-")
+    suggesters = []
+    try:
+        write_synthetic_history(data_dir, size)
+        results = {"messages": size}
+
+        def new_suggester() -> ConversationSuggester:
+            # Caching would hide the cost of everything after the first call
+            # Retrieval is off so background indexing doesn't skew the timings
+            suggester = ConversationSuggester(data_dir=data_dir, host=server.url, cache_size=0,
+                                              context_tokens=context_tokens, retrieve_k=0, durability=durability)
+            suggesters.append(suggester)
+            return suggester
+
+        # Startup: constructing the suggester and touching the selected person
+        start = time.perf_counter()
+        suggester = new_suggester()
+        suggester.conversations.count(PERSON)
+        results["load_s"] = round(time.perf_counter() - start, 4)
+
+        # Prompt building, without the LLM summary update so only local work is timed
+        _, cold = timed(suggester._build_suggestion_prompt, PERSON, MOOD, PERSONALITY, GENDER, update_summary=False)
+        results["prompt_build_cold_ms"] = ms(cold)
+        samples = [timed(suggester._build_suggestion_prompt, PERSON, MOOD, PERSONALITY, GENDER, update_summary=False)[1]
+                   for _ in range(turns)]
+        results.update(latency_metrics("prompt_build", samples))
+
+        # Per-turn persistence
+        samples = [timed(suggester.add_conversation, PERSON, [f"benchmark turn {i}"])[1] for i in range(turns)]
+        results.update(latency_metrics("add_conversation", samples))
+        samples = [timed(suggester.add_feedback, PERSON, "suggestion", "too generic", 2, MOOD, PERSONALITY, GENDER)[1]
+                   for _ in range(turns)]
+        results.update(latency_metrics("add_feedback", samples))
+        _, elapsed = timed(suggester.flush)
+        results["flush_ms"] = ms(elapsed)
+
+        # End to end against the mock server; the first call may also fold
+        # older history into the rolling summary, which is part of the cost
+        samples = [timed(suggester.get_suggestions, PERSON, MOOD, PERSONALITY, GENDER)[1] for _ in range(turns)]
+        results.update(latency_metrics("get_suggestions", samples))
+        samples = []
+        first_token = []
+        for i in range(turns):
+            suggester.add_conversation(PERSON, [f"chat turn {i}"])
+            _, elapsed = timed(suggester.chat_with_ai, PERSON, MOOD, PERSONALITY, GENDER, on_token=lambda token: None)
+            samples.append(elapsed)
+            stats = suggester.get_last_call_stats()
+            if stats and stats["time_to_first_token"] is not None:
+                first_token.append(stats["time_to_first_token"])
+        results.update(latency_metrics("chat_with_ai", samples))
+        results.update(latency_metrics("chat_first_token", first_token))
+
+        # Peak Python memory for a fresh session: load, build a prompt, record a turn
+        tracemalloc.start()
+        suggester = new_suggester()
+        suggester._build_suggestion_prompt(PERSON, MOOD, PERSONALITY, GENDER, update_summary=False)
+        suggester.add_conversation(PERSON, ["memory probe"])
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        results["peak_memory_mb"] = round(peak / (1024 * 1024), 3)
+        return results
+    finally:
+        for suggester in suggesters:
+            suggester.close()
+        shutil.rmtree(data_dir, ignore_errors=True)
+
+def compare(current: Dict, baseline: Dict, tolerance: float) -> List[str]:
+    """List metrics that got worse than the baseline by more than tolerance."""
+    regressions = []
+    for size, metrics in current["results"].items():
+        base_metrics = baseline.get("results", {}).get(size)
+        if not base_metrics:
+            continue
+        for name, value in metrics.items():
+            base = base_metrics.get(name)
+            if base is None or name == "messages":
+                continue
+            floor = next((f for suffix, f in NOISE_FLOORS.items() if name.endswith(suffix)), 0.0)
+            if value - base > floor and value > base * (1 + tolerance):
+                regressions.append(f"{size} messages: {name} {base} -> {value} (+{(value / base - 1) * 100 if base else float('inf'):.0f}%)")
+    return regressions
+
+def print_results(report: Dict):
+    """Print one column per history size."""
+    sizes = list(report["results"].keys())
+    table = Table(title="Benchmark results")
+    table.add_column("Metric", style="cyan")
+    for size in sizes:
+        table.add_column(f"{int(size):,} msgs", justify="right", style="green")
+    metrics = [m for m in report["results"][sizes[0]].keys() if m != "messages"]
+    for metric in metrics:
+        table.add_row(metric, *(str(report["results"][size].get(metric, "")) for size in sizes))
+    console.print(table)
+
+def main(argv: Optional[list] = None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark conversation_suggester against a mock Ollama server")
+    parser.add_argument("--sizes", default="100,1000,10000,100000",
+                        help="Comma-separated history sizes in messages (up to 1000000)")
+    parser.add_argument("--turns", type=int, default=20, help="Samples per latency measurement")
+    parser.add_argument("--latency", type=float, default=0.02, help="Mock server seconds before the first token")
+    parser.add_argument("--token-rate", type=float, default=2000.0, help="Mock server tokens per second (0 for instant)")
+    parser.add_argument("--response-tokens", type=int, default=60, help="Mock server tokens per response")
+    parser.add_argument("--context-tokens", type=int, default=1024, help="Context budget passed to ConversationSuggester")
+    parser.add_argument("--durability", choices=["async", "sync"], default="async",
+                        help="Durability setting passed to ConversationSuggester")
+    parser.add_argument("--output", default="bench_results.json", help="Where to write the JSON results")
+    parser.add_argument("--baseline", help="JSON results of a previous run to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Allowed relative slowdown before failing")
+    args = parser.parse_args(argv)
+
+    sizes = [int(s) for s in args.sizes.split(",") if s.strip()]
+    report = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "python": sys.version.split()[0],
+            "platform": platform.platform(),
+            "turns": args.turns,
+            "context_tokens": args.context_tokens,
+            "durability": args.durability,
+            "mock": {"latency": args.latency, "token_rate": args.token_rate, "response_tokens": args.response_tokens}
+        },
+        "results": {}
+    }
+    with MockOllamaServer(latency=args.latency, token_rate=args.token_rate, response_tokens=args.response_tokens) as server:
+        for size in sizes:
+            with console.status(f"[bold blue]Benchmarking {size:,} messages...[/bold blue]"):
+                report["results"][str(size)] = bench_size(size, server, args.turns, args.context_tokens, args.durability)
+
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=4)
+    print_results(report)
+    console.print(f"[green]Results written to {args.output}[/green]")
+
+    if args.baseline:
+        with open(args.baseline, 'r') as f:
+            baseline = json.load(f)
+        regressions = compare(report, baseline, args.tolerance)
+        if regressions:
+            console.print(f"[red]{len(regressions)} regressions against {args.baseline}:[/red]")
+            for regression in regressions:
+                console.print(f"[red]- {regression}[/red]")
+            return 1
+        console.print(f"[green]No regressions against {args.baseline} (tolerance {args.tolerance:.0%}).[/green]")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
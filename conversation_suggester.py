@@ -1,22 +1,1530 @@
+import argparse
+import asyncio
+import atexit
+import hashlib
+import itertools
 import json
-from typing import List, Dict
+import queue
+import random
+import re
+import signal
+import sqlite3
+import tempfile
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import Future
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, List, Dict, Optional
 import os
+import httpx
+import numpy as np
 from rich.console import Console
+from rich.live import Live
 from rich.prompt import Prompt, Confirm
 from rich.panel import Panel
+from rich.spinner import Spinner
 from rich.table import Table
-from ollama import Client
+from rich.text import Text
+from rich.progress import Progress, BarColumn, DownloadColumn, MofNCompleteColumn, TextColumn, TimeElapsedColumn
+from ollama import AsyncClient, Client, ResponseError
 import time
 
 console = Console()
 
+HISTORY_PAGE_SIZE = 50  # Messages shown per page by the history command
+SESSION_MAX_MESSAGES = 40  # Chat session length before it is restarted from recent history
+SUMMARY_TOKENS = 256  # Part of the context budget reserved for the rolling summary
+SUMMARY_FOLD_TOKENS = 256  # Overflow allowed past the budget before it is folded into the summary
+SUMMARY_MAX_BACKLOG_TOKENS = 4096  # Most unsummarized history folded in a single update
+SUMMARY_MAX_BACKLOG_MESSAGES = 500
+# Auto model routing: for each task, the latency that scores half marks and how much
+# latency counts against feedback ratings. Chat is judged on time to first token.
+AUTO_ROUTING = {
+    "chat": {"target": 1.0, "latency_weight": 0.7},
+    "suggestions": {"target": 5.0, "latency_weight": 0.3}
+}
+AUTO_MIN_RATINGS = 3  # Ratings needed before a model's average is trusted
+AUTO_EXPLORE = 0.1  # Share of auto-routed calls sent to a usable model with few latency samples
+LATENCY_WINDOW = 20  # Recent calls per model and task kept for routing
+EMBED_BATCH = 64  # Texts per embedding request
+EMBED_MAX_TOKENS = 512  # Longer texts are truncated before embedding
+RETRIEVAL_MIN_SCORE = 0.3  # Cosine similarity below which a past message isn't considered related
+RETRIEVAL_MESSAGE_TOKENS = 128  # Longest retrieved message put in a prompt
+RETRIEVAL_QUERY_MESSAGES = 3  # Latest messages embedded as the retrieval query
+QUERY_CACHE_SIZE = 64  # Query embeddings kept for reuse
+# Raised when Ollama can't be reached: newer clients wrap httpx errors in ConnectionError, older ones don't
+CONNECT_ERRORS = (ConnectionError, httpx.TransportError)
+PREFETCH_WAIT = 30.0  # Longest wait for a running prefetch before generating directly instead
+JSON_START = re.compile(r"\s*(?:```\w*\s*)?[\[{]")  # A reply that is JSON, possibly in a code fence
+LIST_MARKER = re.compile(r"^\s*(?:\d+[.)]|[-*•])\s+")  # "1. ", "2) ", "- ", "* ", "• "
+QUOTE_PAIRS = {'"': '"', '“': '”'}
+WRAPPING_EMPHASIS = re.compile(r"(\*\*|__)(\S(?:(?:(?!\1).)*\S)?)\1", re.DOTALL)  # "**...**" around a whole text
+WORD_EMPHASIS = re.compile(r"(?<![\w*])\*\*(?=\S)([^*\n]+?)(?<=\S)\*\*(?![\w*])")  # "**...**" around words
+
+def estimate_tokens(text: str) -> int:
+    """Roughly estimate the number of tokens in a text (about 4 characters per token)."""
+    return max(1, len(text) // 4)
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """Shorten a text to roughly max_tokens, keeping its beginning."""
+    max_chars = max_tokens * 4
+    if len(text) <= max_chars:
+        return text
+    return text[:max_chars].rstrip() + " […]"
+
+def normalize(vectors: np.ndarray) -> np.ndarray:
+    """Scale rows to unit length so a dot product is their cosine similarity."""
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.where(norms == 0, 1, norms)
+
+def suggestion_schema(n: int) -> Dict:
+    """JSON schema for n suggestions, passed to Ollama as the output format."""
+    return {
+        "type": "object",
+        "properties": {
+            "suggestions": {
+                "type": "array",
+                "minItems": n,
+                "maxItems": n,
+                "items": {
+                    "type": "object",
+                    "properties": {"text": {"type": "string"}, "rationale": {"type": "string"}},
+                    "required": ["text", "rationale"]
+                }
+            }
+        },
+        "required": ["suggestions"]
+    }
+
+def close_json(text: str) -> str:
+    """Close the strings, arrays and objects left open by a truncated JSON document."""
+    stack = []
+    in_string = escaped = False
+    for char in text:
+        if in_string:
+            if escaped:
+                escaped = False
+            elif char == "\\":
+                escaped = True
+            elif char == '"':
+                in_string = False
+        elif char == '"':
+            in_string = True
+        elif char in "{[":
+            stack.append("}" if char == "{" else "]")
+        elif char in "}]" and stack:
+            stack.pop()
+    if in_string:
+        text += '"'
+    text = text.rstrip().rstrip(",")
+    if text.endswith(":"):
+        text += " null"
+    return text + "".join(reversed(stack))
+
+def repair_json(text: str) -> tuple:
+    """Parse JSON that an LLM wrapped in prose or code fences, left trailing commas in or cut off.
+
+    Returns (data, truncated), data being None if nothing could be recovered.
+    """
+    starts = [i for i in (text.find("{"), text.find("[")) if i >= 0]
+    if not starts:
+        return None, False
+    candidate = text[min(starts):]
+    end = max(candidate.rfind("}"), candidate.rfind("]"))
+    for attempt in ([candidate[:end + 1]] if end >= 0 else []) + [candidate]:
+        attempt = re.sub(r",\s*([}\]])", r"\1", attempt)
+        try:
+            return json.loads(attempt), False
+        except ValueError:
+            pass
+    try:
+        return json.loads(re.sub(r",\s*([}\]])", r"\1", close_json(candidate))), True
+    except ValueError:
+        pass
+    # Last resort: salvage the complete "text" fields
+    texts = re.findall(r'"text"\s*:\s*"((?:[^"\\]|\\.)*)"', candidate)
+    items = []
+    for value in texts:
+        try:
+            items.append({"text": json.loads(f'"{value}"')})
+        except ValueError:
+            continue
+    return (items or None), False
+
+def suggestion_items(data) -> List[Dict]:
+    """Get the well-formed {"text", "rationale"} items of parsed suggestion JSON."""
+    if isinstance(data, dict):
+        data = data.get("suggestions")
+    if not isinstance(data, list):
+        return []
+    items = []
+    for item in data:
+        if isinstance(item, str):
+            item = {"text": item}
+        if not isinstance(item, dict):
+            continue
+        text = item.get("text", item.get("suggestion"))
+        rationale = item.get("rationale", item.get("reason"))
+        if isinstance(text, str) and text.strip():
+            items.append({"text": text.strip(), "rationale": rationale.strip() if isinstance(rationale, str) else ""})
+    return items
+
+def split_suggestion_lines(response: str) -> List[str]:
+    """Split a free-form response into suggestions, dropping preamble and joining wrapped lines.
+
+    When the response is a numbered or bulleted list, each item is one
+    suggestion and indented lines right after an item continue it; other
+    lines, like an introduction or closing remark, are ignored. Otherwise
+    every line is a suggestion, except ones ending in a colon, like "Here
+    are some suggestions:".
+    """
+    lines = response.splitlines()
+    if not any(LIST_MARKER.match(line) for line in lines):
+        return [line.strip() for line in lines if line.strip() and not line.strip().endswith(":")]
+    items = []
+    continuing = False
+    for line in lines:
+        marker = LIST_MARKER.match(line)
+        if marker:
+            items.append(line[marker.end():].strip())
+            continuing = True
+        elif continuing and line.strip() and line[:1].isspace():
+            items[-1] += " " + line.strip()
+        else:
+            continuing = False
+    return items
+
+# Files are created as open() would create them, not with mkstemp's 0600
+UMASK = os.umask(0)
+os.umask(UMASK)
+
+def clean_suggestion_text(text: str) -> str:
+    """Remove the quotes and bold markers a model put around a suggestion.
+
+    Quotes are removed only as a matching pair around the whole text, and
+    ``__`` only around a whole text that isn't a single name, so quotes within
+    a suggestion and names like __init__ are kept. ``**`` is also removed
+    around single words or phrases.
+    """
+    text = text.strip()
+    while True:
+        emphasis = WRAPPING_EMPHASIS.fullmatch(text)
+        if emphasis and not (emphasis.group(1) == "__" and re.fullmatch(r"\w+", emphasis.group(2))):
+            text = emphasis.group(2).strip()
+            continue
+        close = QUOTE_PAIRS.get(text[:1])
+        if close and len(text) > 1 and text.endswith(close) and text[0] not in text[1:-1] and close not in text[1:-1]:
+            text = text[1:-1].strip()
+            continue
+        return WORD_EMPHASIS.sub(r"\1", text)
+
+def write_atomic(path: str, text: str, durable: bool = True):
+    """Replace a file so readers and crashes see either the old or the new contents.
+
+    Each call writes its own temporary file, so concurrent writers of the same
+    path don't interfere; the last rename wins. With ``durable`` the data and
+    the rename are fsynced before returning.
+    """
+    directory = os.path.dirname(path) or "."
+    fd, tmp_file = tempfile.mkstemp(dir=directory, prefix=os.path.basename(path) + ".", suffix=".tmp")
+    try:
+        with os.fdopen(fd, 'w') as f:
+            f.write(text)
+            if durable:
+                f.flush()
+                os.fsync(f.fileno())
+        os.chmod(tmp_file, 0o666 & ~UMASK)
+        os.replace(tmp_file, path)
+    except BaseException:
+        try:
+            os.remove(tmp_file)
+        except OSError:
+            pass
+        raise
+    if durable:
+        fsync_directory(directory)
+
+def fsync_directory(directory: str):
+    """Make a rename or newly created file in directory durable."""
+    if not hasattr(os, "O_DIRECTORY"):
+        return  # Not supported on Windows, where the rename is durable once it returns
+    fd = os.open(directory, os.O_RDONLY | os.O_DIRECTORY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+class WriteBehind:
+    """Flushes buffered changes of registered stores from a background thread.
+
+    Stores buffer a mutation in memory, call mark_dirty() and return. The
+    flusher waits ``interval`` seconds after the first change so that
+    changes arriving together are written in a single flush, then calls the
+    flush function of every store. flush() writes everything immediately;
+    it is also registered with atexit so buffered changes survive a normal
+    exit, including one caused by SIGINT or SIGTERM (see main()).
+    """
+
+    def __init__(self, metrics: "Metrics", interval: float = 1.0):
+        self.metrics = metrics
+        self.interval = interval
+        self.flushes = []  # Flush functions of the registered stores
+        self.dirty = threading.Event()
+        self.lock = threading.Lock()  # Serializes flushes
+        self.closed = False
+        self.thread = threading.Thread(target=self._run, name="write-behind", daemon=True)
+        self.thread.start()
+        atexit.register(self.flush)
+
+    def register(self, flush: Callable[[], None]):
+        self.flushes.append(flush)
+
+    def mark_dirty(self):
+        """Schedule a flush within interval seconds."""
+        self.dirty.set()
+
+    def _run(self):
+        while not self.closed:
+            self.dirty.wait()
+            time.sleep(self.interval)
+            self.flush()
+
+    def flush(self):
+        """Write every store's buffered changes now."""
+        with self.lock:
+            self.dirty.clear()
+            for flush in self.flushes:
+                try:
+                    with self.metrics.span("flush"):
+                        flush()
+                except Exception as e:
+                    # The store keeps what it couldn't write, so the next flush retries it
+                    console.print(f"[red]Error saving data: {e}[/red]")
+                    self.dirty.set()
+
+    def close(self):
+        """Flush and stop the background thread."""
+        self.closed = True
+        self.flush()
+        self.dirty.set()
+
+class ConversationLog:
+    """Legacy append-only JSONL message log replayed on top of a JSON snapshot.
+
+    This is the storage format used before conversations were sharded per
+    person: a ``conversations.json`` snapshot plus a ``conversations.jsonl``
+    log with one ``{"person": ..., "message": ...}`` line per message. It is
+    only read to migrate existing history into a ShardedStore.
+
+    Compaction replaced the snapshot and then truncated the log, so a crash
+    between the two left a log whose records are also at the end of the
+    snapshot. That format recorded nothing to tell this apart, so the log is
+    only skipped when, for every person in it, the snapshot history ends
+    with exactly that person's log records.
+    """
+
+    def __init__(self, snapshot_file: str, log_file: str):
+        self.snapshot_file = snapshot_file
+        self.log_file = log_file
+
+    def _read_log(self) -> Dict[str, List[str]]:
+        """Read the log's messages per person, in order."""
+        records = {}
+        with open(self.log_file, 'rb') as f:
+            for line in f:
+                try:
+                    if not line.endswith(b"\n"):
+                        raise json.JSONDecodeError("Unterminated record", "", 0)
+                    record = json.loads(line)
+                except (json.JSONDecodeError, UnicodeDecodeError):
+                    # A torn final line from an interrupted write; the
+                    # records before it are intact.
+                    break
+                records.setdefault(record["person"], []).append(record["message"])
+        return records
+
+    def load(self) -> Dict[str, List[str]]:
+        """Load the snapshot and replay the log on top of it."""
+        conversations = {}
+        if os.path.exists(self.snapshot_file) and os.path.getsize(self.snapshot_file) > 0:
+            with open(self.snapshot_file, 'r') as f:
+                conversations = json.load(f)
+        if os.path.exists(self.log_file):
+            log = self._read_log()
+            folded = bool(log) and all(
+                len(conversations.get(person, [])) >= len(messages)
+                and conversations[person][-len(messages):] == messages
+                for person, messages in log.items()
+            )
+            if not folded:
+                for person, messages in log.items():
+                    conversations.setdefault(person, []).extend(messages)
+        return conversations
+
+class ShardedStore:
+    """Per-person append-only JSONL shards with a small index of people.
+
+    Only ``index.json`` (file name, record count, shard size in bytes and
+    last activity per person) is read at startup. A person's shard is read
+    when their history is first requested, and tail() and iter_records()
+    serve recent records or pages of a large history without materializing
+    all of it.
+
+    Without a flusher every append() is written and fsynced before it
+    returns; the index is only replaced right away when a person is added,
+    and otherwise by flush() or at exit, since _check_shard() recounts the
+    part of a shard beyond the size the index recorded. With a WriteBehind flusher, appended records are kept in
+    ``pending`` (and visible to every reader) until the next flush, which
+    writes each person's records in one go and then replaces the index.
+    on_flush is called with each person whose records were written.
+    """
+
+    def __init__(self, directory: str, legacy_loader: Optional[Callable[[], Dict[str, list]]] = None,
+                 flusher: Optional[WriteBehind] = None, on_flush: Optional[Callable[[str], None]] = None):
+        self.directory = directory
+        self.index_file = os.path.join(directory, "index.json")
+        self.lock = threading.RLock()
+        self.checked = set()  # people whose shard was verified this session
+        self.pending = {}  # person -> records appended but not written yet
+        self.torn = {}  # person -> shard size to truncate to before the next write (None: nothing written)
+        self.index_dirty = False
+        self.flusher = flusher
+        self.on_flush = on_flush
+        if flusher is not None:
+            flusher.register(self.flush)
+        else:
+            atexit.register(self.flush)
+        os.makedirs(directory, exist_ok=True)
+        if os.path.exists(self.index_file):
+            with open(self.index_file, 'r') as f:
+                self.index = json.load(f)
+        else:
+            self.index = {}
+            if legacy_loader:
+                self._migrate(legacy_loader())
+            self._save_index()
+
+    def __contains__(self, person: str) -> bool:
+        return person in self.index
+
+    def __iter__(self):
+        return iter(self.index)
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    def keys(self):
+        return self.index.keys()
+
+    def info(self, person: str) -> Dict:
+        """Get the index entry (file, count, last_activity) for a person."""
+        return self.index[person]
+
+    def count(self, person: str) -> int:
+        """Get the number of records stored for a person."""
+        if person not in self.index:
+            return 0
+        self._check_shard(person)
+        return self.index[person]["count"]
+
+    def _shard_path(self, person: str) -> str:
+        return os.path.join(self.directory, self.index[person]["file"])
+
+    def _new_shard_name(self, person: str) -> str:
+        slug = re.sub(r"[^A-Za-z0-9_-]+", "_", person)[:40] or "person"
+        digest = hashlib.sha1(person.encode("utf-8")).hexdigest()[:8]
+        return f"{slug}-{digest}.jsonl"
+
+    def _check_shard(self, person: str):
+        """Drop a torn trailing record and resync the index count, once per session.
+
+        The index records how many bytes of the shard its count covers. Only
+        what lies beyond that is recounted; a shard shorter than that, or an
+        index from before sizes were recorded, is recounted in full.
+        """
+        with self.lock:
+            if person in self.checked:
+                return
+            self.checked.add(person)
+            path = self._shard_path(person)
+            if not os.path.exists(path):
+                open(path, 'a').close()
+            entry = self.index[person]
+            size = os.path.getsize(path)
+            with open(path, 'rb') as f:
+                start = entry.get("bytes")
+                if start is not None and 0 < start <= size:
+                    f.seek(start - 1)
+                    if f.read(1) != b"\n":
+                        start = None
+                elif start != 0:
+                    start = None
+                if start is None:
+                    start, count = 0, 0
+                elif start == size:
+                    return
+                else:
+                    count = entry["count"] - len(self.pending.get(person, ()))
+                f.seek(start)
+                valid_bytes = start
+                while True:
+                    block = f.read(1 << 20)
+                    if not block:
+                        break
+                    newlines = block.count(b"\n")
+                    if newlines:
+                        count += newlines
+                        valid_bytes = f.tell() - len(block) + block.rindex(b"\n") + 1
+            if valid_bytes < size:
+                os.truncate(path, valid_bytes)
+            entry["bytes"] = valid_bytes
+            entry["count"] = count + len(self.pending.get(person, ()))
+            if self.flusher is None:
+                self._save_index()
+            else:
+                # Saved by the next flush, once the pending records it counts are written
+                self.index_dirty = True
+                self.flusher.mark_dirty()
+
+    def iter_records(self, person: str, start: int = 0, stop: Optional[int] = None):
+        """Lazily yield a person's records in order, optionally sliced."""
+        if person not in self.index:
+            return
+        self._check_shard(person)
+        with self.lock:
+            pending = list(self.pending.get(person, ()))
+            written = self.index[person]["count"] - len(pending)
+        stop = written + len(pending) if stop is None else stop
+        # The shard only grows, so its first `written` records can be read without the lock
+        if start < min(stop, written):
+            with open(self._shard_path(person), 'rb') as f:
+                for line in itertools.islice(f, start, min(stop, written)):
+                    yield json.loads(line)
+        yield from pending[max(0, start - written):max(0, stop - written)]
+
+    def iter_from_offset(self, person: str, offset: int = 0):
+        """Yield (offset, end offset, record) for a person's records from a byte offset on."""
+        if person not in self.index:
+            return
+        self._check_shard(person)
+        with open(self._shard_path(person), 'rb') as f:
+            f.seek(offset)
+            for line in f:
+                if not line.endswith(b"\n"):
+                    return  # Still being written
+                yield offset, offset + len(line), json.loads(line)
+                offset += len(line)
+
+    def read_at(self, person: str, offsets: List[int]) -> list:
+        """Read the records starting at the given byte offsets."""
+        with open(self._shard_path(person), 'rb') as f:
+            records = []
+            for offset in offsets:
+                f.seek(offset)
+                records.append(json.loads(f.readline()))
+            return records
+
+    def tail(self, person: str, n: int) -> list:
+        """Get a person's last n records, reading only the end of their shard."""
+        if person not in self.index or n <= 0:
+            return []
+        self._check_shard(person)
+        with self.lock:
+            pending = self.pending.get(person, [])
+            if len(pending) >= n or len(pending) == self.index[person]["count"]:
+                return pending[-n:]
+            # Hold the lock so a flush can't move pending records into the shard meanwhile
+            return self._read_tail(person, n - len(pending)) + pending
+
+    def _read_tail(self, person: str, n: int) -> list:
+        with open(self._shard_path(person), 'rb') as f:
+            f.seek(0, os.SEEK_END)
+            position = f.tell()
+            data = b""
+            # The shard ends with a newline, so n records need n + 1 of them
+            while position > 0 and data.count(b"\n") <= n:
+                step = min(8192, position)
+                position -= step
+                f.seek(position)
+                data = f.read(step) + data
+        lines = data.splitlines()
+        if position > 0:
+            lines = lines[1:]  # The first line may be a partial record
+        return [json.loads(line) for line in lines[-n:]]
+
+    def append(self, person: str, records: list):
+        """Append records to a person's shard and update the index, or buffer them for the flusher."""
+        with self.lock:
+            added = person not in self.index
+            if added:
+                self.index[person] = {"file": self._new_shard_name(person), "count": 0, "bytes": 0,
+                                      "last_activity": None}
+                self.checked.add(person)
+            else:
+                self._check_shard(person)
+            if self.flusher is None:
+                self._write_records(person, records)
+            else:
+                self.pending.setdefault(person, []).extend(records)
+            self.index[person]["count"] += len(records)
+            self.index[person]["last_activity"] = time.strftime("%Y-%m-%d %H:%M:%S")
+            if self.flusher is None and added:
+                self._save_index()  # A shard missing from the index would never be read
+                self.index_dirty = False
+            else:
+                self.index_dirty = True
+        if self.flusher is None:
+            if self.on_flush:
+                self.on_flush(person)
+        else:
+            self.flusher.mark_dirty()
+
+    def _write_records(self, person: str, records: list):
+        """Append records to a shard, leaving an entry in torn until all of them are on disk."""
+        path = self._shard_path(person)
+        created = not os.path.exists(path)
+        with open(path, 'ab') as f:
+            start = self.torn.get(person)
+            if start is not None:
+                f.truncate(start)  # Drop what a failed write left behind; its records are being written again
+            else:
+                start = os.fstat(f.fileno()).st_size
+            self.torn[person] = start
+            data = "".join(json.dumps(record) + "\n" for record in records).encode("utf-8")
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+            del self.torn[person]
+            self.index[person]["bytes"] = start + len(data)
+        if created:
+            fsync_directory(self.directory)
+
+    def flush(self):
+        """Write buffered records, then the index that counts them."""
+        written = []
+        with self.lock:
+            # Shards first: after a crash between the two, the next session recounts from the shards
+            for person in list(self.pending):
+                # Records leave pending before they are written, so an exception (e.g. SystemExit
+                # from a signal) after the write can't make the exit flush write them again. They
+                # go back only while torn says the write didn't finish, and the retry truncates first.
+                records = None
+                try:
+                    self.torn.setdefault(person, None)
+                    records = self.pending.pop(person)
+                    self._write_records(person, records)
+                except BaseException:
+                    if records is not None and person in self.torn:
+                        self.pending[person] = records
+                    raise
+                written.append(person)
+            if self.index_dirty:
+                self._save_index()
+                self.index_dirty = False
+        if self.on_flush:
+            for person in written:
+                self.on_flush(person)
+
+    def sidecar_path(self, person: str, name: str, extension: str = "json") -> str:
+        """Get the path of a file stored next to a person's shard."""
+        stem = os.path.splitext(self.index[person]["file"])[0]
+        return os.path.join(self.directory, f"{stem}.{name}.{extension}")
+
+    def read_sidecar(self, person: str, name: str) -> Optional[Dict]:
+        """Read a JSON document stored next to a person's shard."""
+        if person not in self.index:
+            return None
+        try:
+            with open(self.sidecar_path(person, name), 'r') as f:
+                return json.load(f)
+        except (OSError, json.JSONDecodeError):
+            return None
+
+    def write_sidecar(self, person: str, name: str, data: Dict):
+        """Atomically replace a JSON document stored next to a person's shard."""
+        write_atomic(self.sidecar_path(person, name), json.dumps(data, indent=4))
+
+    def _save_index(self):
+        write_atomic(self.index_file, json.dumps(self.index, indent=4))
+
+    def _migrate(self, data: Dict[str, list]):
+        """Split a legacy person -> records mapping into shards."""
+        for person, records in data.items():
+            self.index[person] = {"file": self._new_shard_name(person), "count": 0, "bytes": 0,
+                                  "last_activity": None}
+            with open(self._shard_path(person), 'wb') as f:
+                for record in records:
+                    f.write((json.dumps(record) + "\n").encode("utf-8"))
+                self.index[person]["bytes"] = f.tell()
+            self.index[person]["count"] = len(records)
+            if records and isinstance(records[-1], dict):
+                self.index[person]["last_activity"] = records[-1].get("timestamp")
+            self.checked.add(person)
+
+class FeedbackStore:
+    """SQLite-backed feedback with incrementally maintained aggregates.
+
+    Raw ratings go into an indexed ``feedback`` table. Each insert also
+    updates ``feedback_stats`` (count and rating sum per person, mood,
+    personality, gender and model) and ``feedback_terms`` (word counts from
+    the comments on low ratings) in the same transaction, so summaries are
+    read from small aggregate tables instead of scanning every rating.
+
+    With a WriteBehind flusher, add() only queues the entry; the flusher
+    inserts everything queued in a single transaction. Reads flush the queue
+    first so they always see every rating added before them.
+
+    The connection is shared by every thread, so each statement runs under
+    ``lock``; otherwise a read could run inside another thread's open
+    transaction.
+    """
+
+    COMPLAINT_RATING = 3  # Ratings at or below this count as complaints
+    STOPWORDS = {
+        "the", "and", "but", "for", "not", "too", "was", "are", "this", "that", "with", "its", "it's",
+        "very", "just", "like", "liked", "dislike", "didn't", "don't", "suggestion", "bit", "really",
+        "more", "less", "much", "all", "you", "your", "have", "has", "had", "some", "about", "would"
+    }
+
+    def __init__(self, db_file: str, legacy_loader: Optional[Callable[[], Dict[str, list]]] = None,
+                 flusher: Optional[WriteBehind] = None):
+        self.db_file = db_file
+        self.lock = threading.Lock()
+        self.pending = []  # (person, entry) added but not inserted yet
+        self.flusher = flusher
+        if flusher is not None:
+            flusher.register(self.flush)
+        self.db = sqlite3.connect(db_file, check_same_thread=False)
+        self.db.row_factory = sqlite3.Row
+        with self.db:
+            self.db.executescript("""
+                CREATE TABLE IF NOT EXISTS feedback (
+                    id INTEGER PRIMARY KEY,
+                    person TEXT NOT NULL,
+                    suggestion TEXT,
+                    feedback TEXT,
+                    rating INTEGER NOT NULL,
+                    mood TEXT,
+                    personality TEXT,
+                    gender TEXT,
+                    model TEXT,
+                    timestamp TEXT
+                );
+                CREATE INDEX IF NOT EXISTS idx_feedback_person ON feedback (person, id);
+                CREATE INDEX IF NOT EXISTS idx_feedback_settings ON feedback (person, mood, personality, gender);
+                CREATE INDEX IF NOT EXISTS idx_feedback_model ON feedback (model, rating);
+                CREATE TABLE IF NOT EXISTS feedback_stats (
+                    person TEXT NOT NULL,
+                    mood TEXT NOT NULL,
+                    personality TEXT NOT NULL,
+                    gender TEXT NOT NULL,
+                    model TEXT NOT NULL,
+                    count INTEGER NOT NULL,
+                    rating_sum INTEGER NOT NULL,
+                    PRIMARY KEY (person, mood, personality, gender, model)
+                );
+                CREATE TABLE IF NOT EXISTS feedback_terms (
+                    person TEXT NOT NULL,
+                    term TEXT NOT NULL,
+                    count INTEGER NOT NULL,
+                    PRIMARY KEY (person, term)
+                );
+                -- Feedback embeddings now live in memmapped files next to the conversation shards
+                DROP TABLE IF EXISTS feedback_vectors;
+                CREATE TABLE IF NOT EXISTS meta (
+                    key TEXT PRIMARY KEY,
+                    value TEXT
+                );
+            """)
+        if not self._query("SELECT value FROM meta WHERE key = 'migrated'"):
+            with self.lock, self.db:
+                if legacy_loader:
+                    for person, entries in legacy_loader().items():
+                        for entry in entries:
+                            self._insert(person, entry)
+                self.db.execute("INSERT INTO meta (key, value) VALUES ('migrated', ?)", (time.strftime("%Y-%m-%d %H:%M:%S"),))
+
+    def __contains__(self, person: str) -> bool:
+        return bool(self._query("SELECT 1 FROM feedback WHERE person = ? LIMIT 1", (person,)))
+
+    @classmethod
+    def complaint_terms(cls, text: str) -> set:
+        """Extract the distinct words of a feedback comment worth counting."""
+        words = re.findall(r"[a-z][a-z']{2,}", text.lower())
+        return {w for w in words if w not in cls.STOPWORDS}
+
+    def _insert(self, person: str, entry: Dict):
+        self.db.execute(
+            "INSERT INTO feedback (person, suggestion, feedback, rating, mood, personality, gender, model, timestamp) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (person, entry.get("suggestion"), entry.get("feedback"), entry["rating"], entry.get("mood"),
+             entry.get("personality"), entry.get("gender"), entry.get("model"), entry.get("timestamp"))
+        )
+        self.db.execute(
+            "INSERT INTO feedback_stats (person, mood, personality, gender, model, count, rating_sum) "
+            "VALUES (?, ?, ?, ?, ?, 1, ?) "
+            "ON CONFLICT (person, mood, personality, gender, model) "
+            "DO UPDATE SET count = count + 1, rating_sum = rating_sum + excluded.rating_sum",
+            (person, entry.get("mood") or "", entry.get("personality") or "", entry.get("gender") or "",
+             entry.get("model") or "", entry["rating"])
+        )
+        if entry["rating"] <= self.COMPLAINT_RATING:
+            for term in self.complaint_terms(entry.get("feedback") or ""):
+                self.db.execute(
+                    "INSERT INTO feedback_terms (person, term, count) VALUES (?, ?, 1) "
+                    "ON CONFLICT (person, term) DO UPDATE SET count = count + 1",
+                    (person, term)
+                )
+
+    def add(self, person: str, entry: Dict):
+        """Record a rating and update the aggregates in one transaction, or queue it for the flusher."""
+        with self.lock:
+            if self.flusher is None:
+                with self.db:
+                    self._insert(person, entry)
+                return
+            self.pending.append((person, entry))
+        self.flusher.mark_dirty()
+
+    def flush(self):
+        """Insert queued ratings in a single transaction."""
+        with self.lock:
+            self._flush_pending()
+
+    def _flush_pending(self):
+        if not self.pending:
+            return
+        with self.db:
+            for person, entry in self.pending:
+                self._insert(person, entry)
+        self.pending = []
+
+    def _query(self, sql: str, params: tuple = ()) -> List[sqlite3.Row]:
+        """Insert queued ratings, then run a read and fetch its rows."""
+        with self.lock:
+            self._flush_pending()
+            return self.db.execute(sql, params).fetchall()
+
+    def count(self, person: str) -> int:
+        """Get the number of feedback entries for a person."""
+        return self._query("SELECT COUNT(*) FROM feedback WHERE person = ?", (person,))[0][0]
+
+    def after(self, person: str, after_id: int, limit: int = 64) -> List[Dict]:
+        """Get a person's feedback entries with an id above after_id, oldest first."""
+        rows = self._query(
+            "SELECT * FROM feedback WHERE person = ? AND id > ? ORDER BY id LIMIT ?", (person, after_id, limit)
+        )
+        return [dict(row) for row in rows]
+
+    def count_after(self, person: str, after_id: int) -> int:
+        """Get the number of a person's feedback entries with an id above after_id."""
+        return self._query("SELECT COUNT(*) FROM feedback WHERE person = ? AND id > ?", (person, after_id))[0][0]
+
+    def by_ids(self, ids: List[int]) -> List[Dict]:
+        """Get feedback entries by id, in id order."""
+        if not ids:
+            return []
+        rows = self._query(f"SELECT * FROM feedback WHERE id IN ({', '.join('?' * len(ids))}) ORDER BY id", tuple(ids))
+        return [dict(row) for row in rows]
+
+    def recent(self, person: str, limit: int = 3) -> List[Dict]:
+        """Get a person's latest feedback entries, oldest first."""
+        rows = self._query(
+            "SELECT * FROM feedback WHERE person = ? ORDER BY id DESC LIMIT ?", (person, limit)
+        )
+        return [dict(row) for row in reversed(rows)]
+
+    def combination_stats(self, person: str) -> List[Dict]:
+        """Get count and mean rating per mood/personality combination, best first."""
+        rows = self._query(
+            "SELECT mood, personality, SUM(count) AS count, CAST(SUM(rating_sum) AS REAL) / SUM(count) AS mean "
+            "FROM feedback_stats WHERE person = ? GROUP BY mood, personality ORDER BY mean DESC, count DESC",
+            (person,)
+        )
+        return [dict(row) for row in rows]
+
+    def top_complaints(self, person: str, limit: int = 5) -> List[tuple]:
+        """Get the most frequent words in a person's low-rated feedback."""
+        rows = self._query(
+            "SELECT term, count FROM feedback_terms WHERE person = ? ORDER BY count DESC, term LIMIT ?",
+            (person, limit)
+        )
+        return [(row["term"], row["count"]) for row in rows]
+
+    def model_stats(self) -> Dict[str, Dict]:
+        """Get count and mean rating per model across everyone."""
+        rows = self._query(
+            "SELECT model, SUM(count) AS count, CAST(SUM(rating_sum) AS REAL) / SUM(count) AS mean "
+            "FROM feedback_stats WHERE model != '' GROUP BY model"
+        )
+        return {row["model"]: {"count": row["count"], "mean": row["mean"]} for row in rows}
+
+class VectorIndex:
+    """Per-person embeddings stored next to the conversation shard.
+
+    Row i of ``<shard>.vectors.f32`` holds the unit-normalized float32
+    embedding of the person's i-th message and row i of ``.vectors.i64``
+    its byte offset in the shard, so new messages are indexed by appending
+    rows and search reads the matrix through a memmap without loading it.
+    ``.vectors.json`` records the model, dimension, row count and how far
+    into the shard has been indexed; embeddings from another model are
+    discarded.
+
+    With another name and position, the same layout indexes something else
+    about the person: the feedback index uses ``feedback_vectors`` with
+    feedback ids as keys and the last embedded id as its position.
+    """
+
+    SEARCH_BLOCK = 65536  # Rows scored at a time
+
+    def __init__(self, store: ShardedStore, model: str, name: str = "vectors", position: str = "indexed_bytes"):
+        self.store = store
+        self.model = model
+        self.name = name
+        self.position = position  # Meta field recording how far indexing got
+        self.lock = threading.Lock()
+
+    def meta(self, person: str) -> Dict:
+        """Get the index state for a person, empty if it was built with another model."""
+        meta = self.store.read_sidecar(person, self.name)
+        if not meta or meta.get("model") != self.model:
+            return {"model": self.model, "dim": None, "count": 0, self.position: 0}
+        return meta
+
+    def reset(self, person: str):
+        """Drop a person's embeddings so they are rebuilt from scratch."""
+        with self.lock:
+            for extension in ("f32", "i64"):
+                path = self.store.sidecar_path(person, self.name, extension)
+                if os.path.exists(path):
+                    os.remove(path)
+            self.store.write_sidecar(person, self.name, {"model": self.model, "dim": None, "count": 0, self.position: 0})
+
+    def append(self, person: str, vectors: np.ndarray, keys: List[int], position: int):
+        """Add the embeddings of the next items with their keys (shard offsets for messages)."""
+        vectors = normalize(np.asarray(vectors, dtype=np.float32))
+        with self.lock:
+            meta = self.meta(person)
+            if meta["dim"] not in (None, vectors.shape[1]):
+                raise ValueError(f"Embedding size changed from {meta['dim']} to {vectors.shape[1]}")
+            dim = vectors.shape[1]
+            for extension, data, row_bytes in (("f32", vectors.astype("<f4"), dim * 4),
+                                               ("i64", np.asarray(keys, dtype="<i8"), 8)):
+                path = self.store.sidecar_path(person, self.name, extension)
+                with open(path, 'ab') as f:
+                    # Drop rows written after the last saved state, e.g. by an interrupted append
+                    f.truncate(meta["count"] * row_bytes)
+                    f.seek(0, os.SEEK_END)
+                    f.write(data.tobytes())
+                    f.flush()
+                    os.fsync(f.fileno())
+            self.store.write_sidecar(person, self.name, {
+                "model": self.model,
+                "dim": dim,
+                "count": meta["count"] + len(vectors),
+                self.position: position
+            })
+
+    def search(self, person: str, query: np.ndarray, k: int, stop: Optional[int] = None) -> List[tuple]:
+        """Get (score, key) of the k items before row stop most similar to query, best first."""
+        meta = self.meta(person)
+        count = meta["count"] if stop is None else min(meta["count"], stop)
+        if count <= 0 or k <= 0:
+            return []
+        query = normalize(np.asarray(query, dtype=np.float32)[None, :])[0]
+        vectors = np.memmap(self.store.sidecar_path(person, self.name, "f32"), dtype="<f4", mode='r', shape=(count, meta["dim"]))
+        offsets = np.memmap(self.store.sidecar_path(person, self.name, "i64"), dtype="<i8", mode='r', shape=(count,))
+        best_scores = np.empty(0, dtype=np.float32)
+        best_rows = np.empty(0, dtype=np.int64)
+        for start in range(0, count, self.SEARCH_BLOCK):
+            scores = vectors[start:start + self.SEARCH_BLOCK] @ query
+            top = np.argpartition(-scores, min(k, len(scores)) - 1)[:k]
+            best_scores = np.concatenate([best_scores, scores[top]])
+            best_rows = np.concatenate([best_rows, top + start])
+            if len(best_scores) > k:
+                keep = np.argpartition(-best_scores, k - 1)[:k]
+                best_scores, best_rows = best_scores[keep], best_rows[keep]
+        order = np.argsort(-best_scores)
+        return [(float(best_scores[i]), int(offsets[best_rows[i]])) for i in order]
+
+class ResponseCache:
+    """LRU cache of LLM responses keyed on the model and a hash of the prompt.
+
+    Entries live in a bounded in-memory OrderedDict and, when cache_dir is set,
+    also as one JSON file per key so they survive restarts. Both tiers expire
+    entries after ttl seconds. The disk tier holds at most max_disk_entries
+    files; past that, expired and then least recently written files are
+    removed until it is back to 90% of the limit.
+    """
+
+    def __init__(self, max_entries: int = 256, ttl: float = 3600, cache_dir: Optional[str] = None,
+                 max_disk_entries: int = 10000):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.cache_dir = cache_dir
+        self.max_disk_entries = max_disk_entries
+        self.entries = OrderedDict()  # key -> (created, response)
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        self.disk_entries = 0
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+            self.disk_entries = len(self._disk_files())
+
+    @staticmethod
+    def make_key(model: str, prompt: str) -> str:
+        """Build the cache key for a model and final prompt."""
+        return hashlib.sha256(f"{model}\0{prompt}".encode("utf-8")).hexdigest()
+
+    def _disk_path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+    def _expired(self, created: float) -> bool:
+        return self.ttl > 0 and time.time() - created > self.ttl
+
+    def get(self, key: str) -> Optional[str]:
+        """Look up a response, falling back to the disk tier on a memory miss."""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and self._expired(entry[0]):
+                del self.entries[key]
+                entry = None
+            if entry is None and self.cache_dir:
+                entry = self._read_disk(key)
+                if entry is not None:
+                    self._store(key, entry)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key: str, response: str):
+        """Store a response in memory and, if enabled, on disk."""
+        entry = (time.time(), response)
+        with self.lock:
+            self._store(key, entry)
+        if self.cache_dir:
+            path = self._disk_path(key)
+            added = not os.path.exists(path)
+            try:
+                write_atomic(path, json.dumps({"created": entry[0], "response": response}), durable=False)
+            except OSError:
+                # The disk tier is best effort; the response is still cached in memory
+                return
+            if added:
+                with self.lock:
+                    self.disk_entries += 1
+                    if self.max_disk_entries > 0 and self.disk_entries > self.max_disk_entries:
+                        self._prune_disk()
+
+    def _store(self, key: str, entry: tuple):
+        self.entries[key] = entry
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def _read_disk(self, key: str) -> Optional[tuple]:
+        path = self._disk_path(key)
+        try:
+            with open(path, 'r') as f:
+                data = json.load(f)
+            entry = (float(data["created"]), data["response"])
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, KeyError, TypeError):
+            # Corrupt or from an incompatible version: drop it so it's written afresh
+            self._remove_disk(path)
+            return None
+        if self._expired(entry[0]):
+            self._remove_disk(path)
+            return None
+        return entry
+
+    def _disk_files(self) -> List[str]:
+        return [name for name in os.listdir(self.cache_dir) if name.endswith(".json")]
+
+    def _remove_disk(self, path: str):
+        try:
+            os.remove(path)
+            self.disk_entries = max(0, self.disk_entries - 1)
+        except FileNotFoundError:
+            pass
+
+    def _prune_disk(self):
+        """Remove expired, then least recently written, files down to 90% of max_disk_entries."""
+        files = []
+        for name in self._disk_files():
+            path = os.path.join(self.cache_dir, name)
+            try:
+                files.append((os.path.getmtime(path), path))
+            except FileNotFoundError:
+                continue
+        self.disk_entries = len(files)
+        files.sort()
+        keep = int(self.max_disk_entries * 0.9)
+        for modified, path in files:
+            if self.disk_entries <= keep and not self._expired(modified):
+                break
+            self._remove_disk(path)
+
+    def clear(self):
+        """Drop all cached responses from both tiers."""
+        with self.lock:
+            self.entries.clear()
+            if self.cache_dir:
+                for name in self._disk_files():
+                    self._remove_disk(os.path.join(self.cache_dir, name))
+
+    def stats(self) -> Dict:
+        """Get hit/miss counters and current size."""
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "entries": len(self.entries)
+        }
+
+class Metrics:
+    """Timing spans, counters and latency histograms for the request path.
+
+    Observations feed cumulative histograms for Prometheus export plus a
+    bounded window of raw samples used for the percentiles shown by the
+    stats command. When trace_file is set, every span is also appended to it
+    as a JSON line tagged with the id of the request it belongs to.
+    """
+
+    PREFIX = "conversation_suggester_"
+    BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+    SAMPLE_WINDOW = 500
+
+    def __init__(self, trace_file: Optional[str] = None, metrics_file: Optional[str] = None):
+        self.lock = threading.Lock()
+        self.histograms = {}  # (name, labels) -> {"buckets", "count", "sum", "samples"}
+        self.counters = {}  # (name, labels) -> value
+        self.metrics_file = metrics_file
+        self.trace = open(trace_file, 'a') if trace_file else None
+        self.local = threading.local()
+        self.request_ids = itertools.count(1)
+        self.server = None
+
+    @staticmethod
+    def _key(name: str, labels: Dict) -> tuple:
+        return (name, tuple(sorted((k, str(v)) for k, v in labels.items() if v is not None)))
+
+    def observe(self, name: str, value: float, **labels):
+        """Record a value in a histogram."""
+        key = self._key(name, labels)
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = {"buckets": [0] * len(self.BUCKETS), "count": 0, "sum": 0.0,
+                             "samples": deque(maxlen=self.SAMPLE_WINDOW)}
+                self.histograms[key] = histogram
+            for i, bound in enumerate(self.BUCKETS):
+                if value <= bound:
+                    histogram["buckets"][i] += 1
+            histogram["count"] += 1
+            histogram["sum"] += value
+            histogram["samples"].append(value)
+
+    def inc(self, name: str, amount: float = 1, **labels):
+        """Increment a counter."""
+        key = self._key(name, labels)
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    @contextmanager
+    def span(self, stage: str, **labels):
+        """Time a stage, counting it as an error if it raises."""
+        start = time.perf_counter()
+        error = None
+        try:
+            yield
+        except Exception as e:
+            error = type(e).__name__
+            self.inc("errors_total", stage=stage, **labels)
+            raise
+        finally:
+            duration = time.perf_counter() - start
+            self.observe("stage_duration_seconds", duration, stage=stage, **labels)
+            if self.trace:
+                record = {
+                    "ts": time.time(),
+                    "request": getattr(self.local, "request_id", None),
+                    "stage": stage,
+                    "duration_ms": round(duration * 1000, 3),
+                    **labels
+                }
+                if error:
+                    record["error"] = error
+                with self.lock:
+                    self.trace.write(json.dumps(record) + "\n")
+                    self.trace.flush()
+
+    @contextmanager
+    def request(self, kind: str, **labels):
+        """Time a top-level request and tag the spans inside it with its id."""
+        outer = getattr(self.local, "request_id", None)
+        if outer is None:
+            self.local.request_id = next(self.request_ids)
+        try:
+            with self.span(kind, **labels):
+                yield
+        finally:
+            if outer is None:
+                self.local.request_id = None
+
+    def stage_summary(self) -> List[Dict]:
+        """Get count, mean, p50, p95 and max (in seconds) per stage and label set."""
+        rows = []
+        with self.lock:
+            for (name, labels), histogram in sorted(self.histograms.items()):
+                if name != "stage_duration_seconds":
+                    continue
+                samples = sorted(histogram["samples"])
+                labels = dict(labels)
+                rows.append({
+                    "stage": labels.pop("stage"),
+                    "labels": labels,
+                    "count": histogram["count"],
+                    "mean": histogram["sum"] / histogram["count"],
+                    "p50": samples[len(samples) // 2],
+                    "p95": samples[min(len(samples) - 1, int(len(samples) * 0.95))],
+                    "max": samples[-1]
+                })
+        return rows
+
+    def counter_totals(self, name: str, by: str) -> Dict[str, float]:
+        """Sum a counter's values grouped by one label."""
+        totals = {}
+        with self.lock:
+            for (counter, labels), value in self.counters.items():
+                if counter == name:
+                    group = dict(labels).get(by, "")
+                    totals[group] = totals.get(group, 0) + value
+        return totals
+
+    def to_prometheus(self) -> str:
+        """Render all metrics in the Prometheus text exposition format."""
+        def label_text(labels, extra: str = "") -> str:
+            parts = [f'{k}="{v}"' for k, v in labels] + ([extra] if extra else [])
+            return "{" + ",".join(parts) + "}" if parts else ""
+
+        lines = []
+        with self.lock:
+            for name in sorted({n for n, _ in self.counters}):
+                lines.append(f"# TYPE {self.PREFIX}{name} counter")
+                for (counter, labels), value in sorted(self.counters.items()):
+                    if counter == name:
+                        lines.append(f"{self.PREFIX}{name}{label_text(labels)} {value}")
+            for name in sorted({n for n, _ in self.histograms}):
+                lines.append(f"# TYPE {self.PREFIX}{name} histogram")
+                for (histogram_name, labels), histogram in sorted(self.histograms.items()):
+                    if histogram_name != name:
+                        continue
+                    for bound, count in zip(self.BUCKETS, histogram["buckets"]):
+                        le = 'le="%s"' % bound
+                        lines.append(f"{self.PREFIX}{name}_bucket{label_text(labels, le)} {count}")
+                    le = 'le="+Inf"'
+                    lines.append(f"{self.PREFIX}{name}_bucket{label_text(labels, le)} {histogram['count']}")
+                    lines.append(f"{self.PREFIX}{name}_sum{label_text(labels)} {histogram['sum']}")
+                    lines.append(f"{self.PREFIX}{name}_count{label_text(labels)} {histogram['count']}")
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self):
+        """Atomically write the Prometheus text file, if one is configured."""
+        if not self.metrics_file:
+            return
+        write_atomic(self.metrics_file, self.to_prometheus(), durable=False)
+
+    def start_export(self, interval: float = 15.0, port: Optional[int] = None):
+        """Rewrite the metrics file periodically and/or serve /metrics over HTTP."""
+        if self.metrics_file:
+            def export_loop():
+                while True:
+                    time.sleep(interval)
+                    self.write_prometheus()
+            threading.Thread(target=export_loop, daemon=True).start()
+        if port:
+            metrics = self
+
+            class MetricsHandler(BaseHTTPRequestHandler):
+                def do_GET(self):
+                    if self.path != "/metrics":
+                        self.send_error(404)
+                        return
+                    data = metrics.to_prometheus().encode("utf-8")
+                    self.send_response(200)
+                    self.send_header("Content-Type", "text/plain; version=0.0.4")
+                    self.send_header("Content-Length", str(len(data)))
+                    self.end_headers()
+                    self.wfile.write(data)
+
+                def log_message(self, format, *args):
+                    pass
+
+            self.server = ThreadingHTTPServer(("127.0.0.1", port), MetricsHandler)
+            threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self):
+        """Write the final metrics file and close the trace."""
+        self.write_prometheus()
+        if self.trace:
+            self.trace.close()
+            self.trace = None
+        if self.server:
+            self.server.shutdown()
+            self.server = None
+
+def join_chunks(method: str, chunks: list):
+    """Combine the chunks of a streamed generate or chat call into the response a non-streamed call returns."""
+    final = chunks[-1]
+    if method == "generate":
+        final["response"] = "".join(chunk["response"] for chunk in chunks)
+    else:
+        final["message"]["content"] = "".join(chunk["message"]["content"] for chunk in chunks)
+    return final
+
+class OllamaEndpoint:
+    """One Ollama server in an OllamaPool, with its health and load."""
+
+    def __init__(self, host: str):
+        self.host = host
+        self.client = Client(host=host)  # Keeps its HTTP connections open between requests
+        self.outstanding = 0
+        self.requests = 0
+        self.failures = 0  # Consecutive failed requests or health checks
+        self.ejected_until = 0.0
+        self.latency = None  # Moving average of successful request times in seconds
+
+class OllamaPool:
+    """Spreads Ollama calls over several servers.
+
+    Each call goes to the healthy endpoint with the fewest requests in
+    flight. Endpoints are ejected after max_failures consecutive errors and
+    re-admitted by a successful health check, or tried again once
+    eject_seconds have passed. A call that fails before producing any output
+    is retried on another endpoint. With hedge_after set, a call that has
+    not produced its first chunk within that many seconds is also sent to a
+    second endpoint and whichever answers first is used; the other is
+    abandoned. Non-streamed generate and chat calls are streamed internally
+    for this, so only a slow first token causes a hedge, not a long
+    response. It can be used wherever an ollama Client is.
+    """
+
+    def __init__(self, hosts: List[str], hedge_after: Optional[float] = None, health_interval: float = 10.0,
+                 max_failures: int = 3, eject_seconds: float = 30.0):
+        self.endpoints = [OllamaEndpoint(host) for host in hosts]
+        self.hedge_after = hedge_after
+        self.max_failures = max_failures
+        self.eject_seconds = eject_seconds
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.lock = threading.Lock()
+        self.rotation = itertools.count()
+        if health_interval:
+            threading.Thread(target=self._health_loop, args=(health_interval,), daemon=True).start()
+
+    def healthy(self, endpoint: OllamaEndpoint) -> bool:
+        return endpoint.failures < self.max_failures or time.time() >= endpoint.ejected_until
+
+    def acquire(self, exclude: tuple = ()) -> OllamaEndpoint:
+        """Pick the healthy endpoint with the fewest requests in flight and count a request on it."""
+        with self.lock:
+            candidates = [e for e in self.endpoints if e not in exclude] or list(self.endpoints)
+            healthy = [e for e in candidates if self.healthy(e)]
+            if healthy:
+                # Rotate the starting point so ties don't always go to the first endpoint
+                offset = next(self.rotation) % len(healthy)
+                endpoint = min(healthy[offset:] + healthy[:offset], key=lambda e: e.outstanding)
+            else:
+                # Everything is ejected: try the endpoint that is due back first
+                endpoint = min(candidates, key=lambda e: e.ejected_until)
+            endpoint.outstanding += 1
+            endpoint.requests += 1
+            return endpoint
+
+    def release(self, endpoint: OllamaEndpoint, elapsed: Optional[float] = None, error: Optional[BaseException] = None):
+        """Finish a request started with acquire, recording its latency or failure."""
+        with self.lock:
+            endpoint.outstanding -= 1
+            if error is None:
+                endpoint.failures = 0
+                if elapsed is not None:
+                    endpoint.latency = elapsed if endpoint.latency is None else 0.8 * endpoint.latency + 0.2 * elapsed
+            elif not isinstance(error, ResponseError) or error.status_code >= 500:
+                # Client errors such as an unknown model say nothing about the server's health
+                self._record_failure(endpoint)
+
+    def _record_failure(self, endpoint: OllamaEndpoint):
+        endpoint.failures += 1
+        if endpoint.failures >= self.max_failures:
+            endpoint.ejected_until = time.time() + self.eject_seconds
+
+    def _health_loop(self, interval: float):
+        while True:
+            time.sleep(interval)
+            for endpoint in self.endpoints:
+                try:
+                    endpoint.client.list()
+                except Exception:
+                    with self.lock:
+                        self._record_failure(endpoint)
+                else:
+                    with self.lock:
+                        endpoint.failures = 0
+
+    def status(self) -> List[Dict]:
+        """Describe each endpoint's health and load."""
+        with self.lock:
+            return [{
+                "host": e.host,
+                "healthy": self.healthy(e),
+                "outstanding": e.outstanding,
+                "requests": e.requests,
+                "failures": e.failures,
+                "latency": round(e.latency, 3) if e.latency is not None else None
+            } for e in self.endpoints]
+
+    def generate(self, **kwargs):
+        return self._request("generate", kwargs)
+
+    def chat(self, **kwargs):
+        return self._request("chat", kwargs)
+
+    def embed(self, **kwargs):
+        return self._request("embed", kwargs, hedge=False)
+
+    def list(self):
+        return self._request("list", {}, hedge=False)
+
+    def _request(self, method: str, kwargs: Dict, hedge: bool = True):
+        if kwargs.get("stream"):
+            return self._run(method, kwargs, stream=True, hedge=hedge)
+        if hedge and self.hedge_after and len(self.endpoints) > 1:
+            chunks = list(self._run(method, dict(kwargs, stream=True), stream=True, hedge=True))
+            return join_chunks(method, chunks)
+        responses = self._run(method, kwargs, stream=False, hedge=False)
+        try:
+            return next(responses)
+        finally:
+            responses.close()
+
+    def _run(self, method: str, kwargs: Dict, stream: bool, hedge: bool):
+        """Run a call with failover and hedging, yielding its chunks (or its single response)."""
+        events = queue.Queue()
+        abandoned = threading.Event()
+        tried = []
+
+        def attempt(endpoint: OllamaEndpoint, index: int):
+            start = time.perf_counter()
+            error = None
+            try:
+                response = getattr(endpoint.client, method)(**kwargs)
+                if not stream:
+                    events.put((index, "chunk", response))
+                else:
+                    for chunk in response:
+                        if abandoned.is_set() or (winner is not None and winner != index):
+                            response.close()
+                            return
+                        events.put((index, "chunk", chunk))
+                events.put((index, "end", None))
+            except Exception as e:
+                error = e
+                events.put((index, "error", e))
+            finally:
+                self.release(endpoint, time.perf_counter() - start, error)
+
+        def launch():
+            endpoint = self.acquire(exclude=tuple(tried))
+            tried.append(endpoint)
+            threading.Thread(target=attempt, args=(endpoint, len(tried) - 1), daemon=True).start()
+
+        winner = None
+        running = 0
+        last_error = None
+        launch()
+        running += 1
+        # Only a streamed call tells when its first token arrives
+        hedge_at = time.perf_counter() + self.hedge_after if hedge and stream and self.hedge_after and len(self.endpoints) > 1 else None
+        try:
+            while True:
+                timeout = None
+                if winner is None and hedge_at is not None:
+                    timeout = max(0.0, hedge_at - time.perf_counter())
+                try:
+                    index, kind, payload = events.get(timeout=timeout)
+                except queue.Empty:
+                    # Slow to answer: race a second endpoint against the first
+                    hedge_at = None
+                    with self.lock:
+                        self.hedges += 1
+                    launch()
+                    running += 1
+                    continue
+                if winner is not None and index != winner:
+                    continue
+                if kind == "chunk":
+                    if winner is None:
+                        winner = index
+                        if index > 0 and running > 1:
+                            with self.lock:
+                                self.hedge_wins += 1
+                    yield payload
+                elif kind == "end":
+                    return
+                else:
+                    running -= 1
+                    if winner is not None:
+                        raise payload
+                    last_error = payload
+                    if len(tried) < len(self.endpoints):
+                        # Nothing was produced yet, so fail over to an endpoint not tried yet
+                        launch()
+                        running += 1
+                    elif running == 0:
+                        raise last_error
+        finally:
+            abandoned.set()
+
+class PrefetchCancelled(BaseException):
+    """Stops a speculative request that is no longer needed.
+
+    Like asyncio.CancelledError it is not an Exception, so metrics spans and
+    error handlers don't treat the cancellation as a failure.
+    """
+
 class ConversationSuggester:
-    def __init__(self):
-        self.conversations_file = "conversations.json"
-        self.feedback_file = "feedback.json"
-        self.conversations = self._load_conversations()
-        self.feedback = self._load_feedback()
-        self.ollama_client = Client()
+    def __init__(self, cache_size: int = 256, cache_ttl: float = 3600, cache_dir: Optional[str] = None,
+                 cache_disk_entries: int = 10000, data_dir: str = ".",
+                 chat_mode: str = "stateless", keep_alive: Optional[str] = "30m", context_tokens: int = 1024,
+                 host: Optional[str] = None, metrics: Optional[Metrics] = None, prefetch: bool = True,
+                 hosts: Optional[List[str]] = None, hedge_after: Optional[float] = None, preload: bool = True,
+                 embed_model: str = "nomic-embed-text", retrieve_k: int = 4, durability: str = "async",
+                 flush_interval: float = 1.0, num_suggestions: int = 4, temperature: Optional[float] = None,
+                 suggestion_format: str = "json"):
+        self.conversations_file = os.path.join(data_dir, "conversations.json")
+        self.conversations_log_file = os.path.join(data_dir, "conversations.jsonl")
+        self.feedback_file = os.path.join(data_dir, "feedback.json")
+        self.metrics = metrics or Metrics()
+        # "async" buffers new messages and feedback and writes them in the background, "sync" before returning
+        self.durability = durability
+        self.flusher = WriteBehind(self.metrics, flush_interval) if durability == "async" else None
+        self.conversations = ShardedStore(os.path.join(data_dir, "conversations"), self._load_legacy_conversations,
+                                          self.flusher, on_flush=self._schedule_indexing)
+        self.feedback_shards_dir = os.path.join(data_dir, "feedback")
+        self.feedback = FeedbackStore(os.path.join(data_dir, "feedback.db"), self._load_legacy_feedback, self.flusher)
+        self.host = host  # Ollama server URL, None for OLLAMA_HOST or the local default
+        self.max_retries = 1  # Retries of an Ollama call that failed to connect
+        # Several servers (or hedging) go through a pool that is used like a Client
+        self.ollama_pool = OllamaPool(hosts or [host], hedge_after) if hosts or hedge_after else None
+        self.ollama_client = self.ollama_pool or Client(host=host)
         self.available_models = {
             "mistral": "Mistral 7B - Fast and efficient",
             "llama2": "Llama 2 7B - Meta's open source model",
@@ -25,6 +1533,34 @@ class ConversationSuggester:
             "starling-lm": "Starling LM - Balanced performance"
         }
         self.model = "mistral"  # Default model
+        self.auto_model = False  # Pick the model per task from measured latency and ratings
+        self.model_latency = {}  # (model, task) -> recent latencies in seconds
+        self.preload = preload  # Load newly selected models in the background
+        self.model_loads = {}  # model -> {"status", "seconds"} of the latest preload
+        self.call_stats = deque(maxlen=100)  # Latency stats of recent LLM calls
+        self.response_cache = ResponseCache(cache_size, cache_ttl, cache_dir, cache_disk_entries) if cache_size > 0 else None
+        self.chat_mode = chat_mode  # "stateless" rebuilds the prompt each turn, "session" reuses the chat
+        self.keep_alive = keep_alive  # How long Ollama keeps the model loaded after a request
+        self.chat_sessions = {}  # person -> session state for session chat mode
+        self.context_tokens = context_tokens  # Token budget for conversation context in prompts
+        self.num_suggestions = max(1, num_suggestions)  # Suggestions asked for in one call
+        self.temperature = temperature  # Sampling temperature for suggestions, None for the model's default
+        self.suggestion_format = suggestion_format  # "json" asks for schema-constrained output, "text" for a list
+        self.embed_model = embed_model
+        self.retrieve_k = retrieve_k  # Related past messages added to prompts, 0 disables retrieval
+        self.vector_index = VectorIndex(self.conversations, embed_model) if retrieve_k > 0 else None
+        self.feedback_index = VectorIndex(self.conversations, embed_model, "feedback_vectors", "indexed_id") if retrieve_k > 0 else None
+        self.embed_error = None  # Why embeddings are unavailable, e.g. the model isn't pulled
+        self.index_lock = threading.Lock()
+        self.index_queue = queue.Queue()
+        self.query_vectors = OrderedDict()  # Hash of a recent window's query text -> Future of its embedding
+        self.query_lock = threading.Lock()
+        self.prefetch = prefetch  # Generate suggestions in the background after each chat turn
+        self.prefetch_job = None  # (key, Future, cancel Event) of the latest speculative request
+        self.prefetch_lock = threading.Lock()
+        self.prefetch_queue = queue.Queue()
+        self.prefetch_thread = None
+        self.local = threading.local()
         self.moods = {
             "casual": "Keep the tone light and friendly, like chatting with a friend",
             "formal": "Maintain a professional and respectful tone",
@@ -54,41 +1590,156 @@ class ConversationSuggester:
             "non-binary": "Use inclusive language and avoid gender assumptions",
             "any": "Use neutral, inclusive language"
         }
+        if self.vector_index is not None:
+            threading.Thread(target=self._index_worker, daemon=True).start()
 
-    def _load_conversations(self) -> Dict:
-        """Load existing conversations from JSON file."""
-        if os.path.exists(self.conversations_file):
-            with open(self.conversations_file, 'r') as f:
-                return json.load(f)
-        return {}
+    def _load_legacy_conversations(self) -> Dict:
+        """Load conversations stored before sharding, for one-time migration."""
+        return ConversationLog(self.conversations_file, self.conversations_log_file).load()
 
-    def _load_feedback(self) -> Dict:
-        """Load user feedback from JSON file."""
-        if os.path.exists(self.feedback_file):
+    def _load_legacy_feedback(self) -> Dict:
+        """Load feedback stored before the SQLite store, for one-time migration."""
+        if os.path.exists(os.path.join(self.feedback_shards_dir, "index.json")):
+            shards = ShardedStore(self.feedback_shards_dir)
+            return {person: list(shards.iter_records(person)) for person in shards}
+        if os.path.exists(self.feedback_file) and os.path.getsize(self.feedback_file) > 0:
             with open(self.feedback_file, 'r') as f:
                 return json.load(f)
         return {}
 
-    def _save_conversations(self):
-        """Save conversations to JSON file."""
-        with open(self.conversations_file, 'w') as f:
-            json.dump(self.conversations, f, indent=4)
+    def _generate(self, prompt: str, on_token: Optional[Callable[[str], None]] = None, fresh: bool = False, model: Optional[str] = None,
+                  **extra) -> str:
+        """Run a completion with the current model, streaming tokens to on_token if given.
+
+        Responses are served from the response cache when possible; fresh=True
+        skips the lookup (the new response still replaces the cached one).
+        model overrides the current model for this call, and extra is passed
+        on to Ollama (e.g. format and options).
+        """
+        return self._complete("generate", dict(extra, prompt=prompt), self._cache_text(prompt, extra), on_token, fresh, model)
 
-    def _save_feedback(self):
-        """Save user feedback to JSON file."""
-        with open(self.feedback_file, 'w') as f:
-            json.dump(self.feedback, f, indent=4)
+    @staticmethod
+    def _cache_text(prompt: str, extra: Dict) -> str:
+        """Get the text a generate request is cached under, covering its format and options."""
+        return prompt + "\n" + json.dumps(extra, sort_keys=True) if extra else prompt
+
+    def _suggestion_request(self) -> Dict:
+        """Get the extra generate arguments of suggestion requests."""
+        extra = {}
+        if self.suggestion_format == "json":
+            extra["format"] = suggestion_schema(self.num_suggestions)
+        if self.temperature is not None:
+            extra["options"] = {"temperature": self.temperature}
+        return extra
+
+    def _chat(self, messages: List[Dict], on_token: Optional[Callable[[str], None]] = None, fresh: bool = False, model: Optional[str] = None) -> str:
+        """Run a chat completion over a list of role/content messages, like _generate."""
+        return self._complete("chat", {"messages": messages}, json.dumps(messages), on_token, fresh, model)
+
+    def _complete(self, endpoint: str, request: Dict, cache_text: str, on_token: Optional[Callable[[str], None]], fresh: bool,
+                  model: Optional[str] = None) -> str:
+        """Call the Ollama generate or chat endpoint with caching and latency stats."""
+        model = model or self.model
+        start = time.perf_counter()
+        cache_key = None
+        if self.response_cache is not None:
+            cache_key = self.response_cache.make_key(model, cache_text)
+            cached = None if fresh else self.response_cache.get(cache_key)
+            if not fresh:
+                self.metrics.inc("cache_lookups_total", model=model, result="hit" if cached is not None else "miss")
+            if cached is not None:
+                if on_token:
+                    on_token(cached)
+                self._record_call_stats(endpoint, model, start, time.perf_counter(), {}, 1, cached=True)
+                return cached
+
+        def token_of(chunk) -> str:
+            return chunk['response'] if endpoint == "generate" else chunk['message']['content']
+
+        call = getattr(self.ollama_client, endpoint)
+        for attempt in range(self.max_retries + 1):
+            first_token_at = None
+            parts = []
+            try:
+                with self.metrics.span("ollama", model=model, endpoint=endpoint):
+                    if on_token is None:
+                        final = call(model=model, stream=False, keep_alive=self.keep_alive, **request)
+                        first_token_at = time.perf_counter()
+                        text = token_of(final)
+                        chunks = 1
+                    else:
+                        final = {}
+                        for chunk in call(model=model, stream=True, keep_alive=self.keep_alive, **request):
+                            token = token_of(chunk)
+                            if token:
+                                if first_token_at is None:
+                                    first_token_at = time.perf_counter()
+                                parts.append(token)
+                                on_token(token)
+                            if chunk.get('done'):
+                                final = chunk
+                        text = "".join(parts)
+                        chunks = len(parts)
+                break
+            except CONNECT_ERRORS:
+                # Only retry if nothing has been shown to the user yet
+                if attempt == self.max_retries or parts:
+                    raise
+                self.metrics.inc("retries_total", model=model, endpoint=endpoint)
+                time.sleep(0.5 * (2 ** attempt))
+        self._record_call_stats(endpoint, model, start, first_token_at, final, chunks)
+        if cache_key is not None and text.strip():
+            self.response_cache.put(cache_key, text)
+        return text
+
+    def _record_call_stats(self, endpoint: str, model: str, start: float, first_token_at: Optional[float], final, chunks: int, cached: bool = False):
+        """Record time-to-first-token and generation speed for an LLM call."""
+        end = time.perf_counter()
+        eval_count = final.get('eval_count') if final else None
+        eval_duration = final.get('eval_duration') if final else None
+        if eval_count and eval_duration:
+            # Ollama reports the decode phase in nanoseconds
+            tokens_per_sec = eval_count / (eval_duration / 1e9)
+        elif first_token_at is not None and end > first_token_at and chunks > 1:
+            tokens_per_sec = chunks / (end - first_token_at)
+        else:
+            tokens_per_sec = None
+        if not cached:
+            if first_token_at is not None:
+                self.metrics.observe("time_to_first_token_seconds", first_token_at - start, model=model, endpoint=endpoint)
+            if final and final.get('prompt_eval_count') is not None:
+                self.metrics.inc("prompt_tokens_total", final['prompt_eval_count'], model=model)
+            self.metrics.inc("completion_tokens_total", eval_count if eval_count else chunks, model=model)
+        stats = {
+            "model": model,
+            "endpoint": endpoint,
+            "prompt_eval_count": final.get('prompt_eval_count') if final else None,
+            "time_to_first_token": (first_token_at - start) if first_token_at is not None else None,
+            "total_time": end - start,
+            "eval_count": eval_count if eval_count else chunks,
+            "tokens_per_sec": tokens_per_sec,
+            "cached": cached,
+            "background": getattr(self.local, "background", False),
+            "timestamp": time.strftime("%Y-%m-%d %H:%M:%S")
+        }
+        self.local.last_stats = stats
+        self.call_stats.append(stats)
+
+    def get_last_call_stats(self) -> Optional[Dict]:
+        """Get latency stats for the most recent LLM call made in the foreground."""
+        return next((stats for stats in reversed(self.call_stats) if not stats["background"]), None)
 
     def add_conversation(self, person: str, messages: List[str]):
         """Add a new conversation or update existing one."""
-        if person not in self.conversations:
-            self.conversations[person] = []
-        self.conversations[person].extend(messages)
-        self._save_conversations()
+        with self.metrics.span("persist_conversation"):
+            self.conversations.append(person, messages)
+        # Indexing is scheduled by the store once the messages are on disk
+        self.cancel_prefetch(person)
 
-    def _generate_prompt(self, person: str, recent_messages: List[str], mood: str, personality: str, gender: str, feedback_context: str = "") -> str:
+    def _generate_prompt(self, person: str, recent_messages: List[str], mood: str, personality: str, gender: str, feedback_context: str = "", summary: str = "",
+                         related: Optional[List[str]] = None) -> str:
         """Generate a prompt for the LLM based on the conversation context, mood, personality, gender, and feedback."""
-        base_prompt = f"""You are a helpful conversation assistant. Analyze the following conversation with {person} and provide 3-4 natural, contextual suggestions for continuing the conversation. Make the suggestions specific to the context and personality of the conversation.
+        base_prompt = f"""You are a helpful conversation assistant. Analyze the following conversation with {person} and provide {self.num_suggestions} natural, contextual and distinct suggestions for continuing the conversation. Make the suggestions specific to the context and personality of the conversation.
 
 Conversation mood: {mood}
 Mood guidelines: {self.moods[mood]}
@@ -98,7 +1749,7 @@ Personality guidelines: {self.personality_types[personality]}
 
 Gender preference: {gender}
 Gender guidelines: {self.gender_preferences[gender]}
-
+{self._format_summary(summary)}{self._format_related(related)}
 Recent messages:
 {chr(10).join(recent_messages)}"""
 
@@ -110,72 +1761,580 @@ User feedback and preferences:
 
 Please adjust your suggestions based on this feedback, maintain the specified mood, and consider the personality type and gender preferences."""
 
+        if self.suggestion_format == "json":
+            base_prompt += f"""
+
+Respond with JSON: {{"suggestions": [{{"text": "...", "rationale": "..."}}]}} with exactly {self.num_suggestions} suggestions, where text is the message to send and rationale is one short sentence on why it fits."""
+        else:
+            base_prompt += f"""
+
+List the {self.num_suggestions} suggestions as a numbered list, one per line, with no introduction or closing remarks."""
         return base_prompt
 
-    def _get_feedback_context(self, person: str) -> str:
-        """Get relevant feedback context for the current conversation."""
-        if person in self.feedback:
-            feedback_list = self.feedback[person]
-            if feedback_list:
-                context = "Based on previous feedback:\n"
-                for entry in feedback_list[-3:]:  # Use last 3 feedback entries
-                    context += f"- {entry['feedback']} (Mood: {entry['mood']}, Rating: {entry['rating']}/5)\n"
-                return context
-        return ""
+    def _format_summary(self, summary: str) -> str:
+        """Format the rolling summary section of a prompt."""
+        if not summary:
+            return ""
+        return f"""
+Summary of the earlier conversation:
+{summary}
+"""
+
+    def _format_related(self, related: Optional[List[str]]) -> str:
+        """Format the retrieved earlier messages section of a prompt."""
+        if not related:
+            return ""
+        return f"""
+Related earlier messages:
+{chr(10).join(related)}
+"""
+
+    def _build_context(self, person: str, update_summary: bool = True, max_messages: Optional[int] = None) -> tuple:
+        """Select the conversation context for a prompt within the token budget.
+
+        Recent messages are kept verbatim, newest first, until context_tokens
+        (minus room for the summary) is used up; a single oversized message is
+        truncated. Older messages are folded into a rolling summary stored next
+        to the person's shard. To avoid an LLM call on every turn, messages
+        pushed out of the window stay in it until they exceed
+        SUMMARY_FOLD_TOKENS, and are then summarized together.
+
+        Returns (summary, recent_messages).
+        """
+        total = self.conversations.count(person)
+        state = self.conversations.read_sidecar(person, "summary") or {"summary": "", "covered": 0}
+        budget = max(64, self.context_tokens - SUMMARY_TOKENS)
+        message_cap = max(32, budget // 2)
+
+        # Walk back from the newest message, reading larger tails as needed
+        unsummarized = total - state["covered"]
+        if max_messages is not None:
+            unsummarized = min(unsummarized, max_messages)
+        fetch = min(16, unsummarized)
+        while True:
+            candidates = self.conversations.tail(person, fetch)
+            recent = []
+            used = 0
+            overflow = 0
+            for message in reversed(candidates):
+                message = truncate_to_tokens(message, message_cap)
+                tokens = estimate_tokens(message)
+                if not overflow and used + tokens <= budget:
+                    recent.append(message)
+                    used += tokens
+                else:
+                    # Everything older than the first message that doesn't fit is overflow
+                    overflow += tokens
+                    if overflow > SUMMARY_FOLD_TOKENS:
+                        break
+            if overflow > SUMMARY_FOLD_TOKENS or fetch >= unsummarized:
+                break
+            fetch = min(fetch * 4, unsummarized)
+        recent.reverse()
+
+        if overflow <= SUMMARY_FOLD_TOKENS:
+            # Everything since the summary still fits (with slack), keep it verbatim
+            return state["summary"], [truncate_to_tokens(m, message_cap) for m in candidates]
+        if update_summary:
+            state = self._update_summary(person, state, total - len(recent))
+        return state["summary"], recent
+
+    def _update_summary(self, person: str, state: Dict, window_start: int) -> Dict:
+        """Fold the messages between the summary and the recent window into the summary."""
+        # Read the backlog newest first so an enormous one (e.g. after an
+        # import) is summarized from its most recent part only
+        window_size = self.conversations.count(person) - window_start
+        limit = min(window_start - state["covered"], SUMMARY_MAX_BACKLOG_MESSAGES)
+        backlog = []
+        used = 0
+        start = window_start
+        for message in reversed(self.conversations.tail(person, window_size + limit)[:limit]):
+            message = truncate_to_tokens(message, SUMMARY_MAX_BACKLOG_TOKENS // 4)
+            tokens = estimate_tokens(message)
+            if backlog and used + tokens > SUMMARY_MAX_BACKLOG_TOKENS:
+                break
+            backlog.append(message)
+            used += tokens
+            start -= 1
+        backlog.reverse()
+        previous = state["summary"] or "(no summary yet)"
+        prompt = f"""Update the running summary of a conversation with {person}.
+
+Current summary:
+{previous}
+
+Messages to add:
+{chr(10).join(backlog)}
+
+Write the updated summary in at most {SUMMARY_TOKENS * 3 // 4} words. Keep names, facts, preferences, plans and open topics; drop small talk. Reply with the summary only."""
+        try:
+            with self.metrics.span("summary_update"):
+                summary = self._generate(prompt).strip()
+        except Exception as e:
+            console.print(f"[yellow]Could not update conversation summary: {str(e)}[/yellow]")
+            return state
+        state = {
+            "summary": truncate_to_tokens(summary, SUMMARY_TOKENS),
+            "covered": window_start,
+            "skipped": state.get("skipped", 0) + (start - state["covered"]),
+            "updated": time.strftime("%Y-%m-%d %H:%M:%S")
+        }
+        self.conversations.write_sidecar(person, "summary", state)
+        return state
+
+    def _get_feedback_context(self, person: str, mood: Optional[str] = None, personality: Optional[str] = None,
+                              related: Optional[List[Dict]] = None) -> str:
+        """Summarize feedback statistics for the person, highlighting the current settings."""
+        combinations = self.feedback.combination_stats(person)
+        if not combinations:
+            return ""
+        total = sum(c["count"] for c in combinations)
+        mean = sum(c["mean"] * c["count"] for c in combinations) / total
+        context = f"Based on previous feedback ({total} ratings, average {mean:.1f}/5):\n"
+        for combination in combinations:
+            if combination["mood"] == mood and combination["personality"] == personality:
+                context += f"- Current settings rated {combination['mean']:.1f}/5 over {combination['count']} ratings\n"
+        best, worst = combinations[0], combinations[-1]
+        context += f"- Best received: {best['mood']} mood, {best['personality']} personality ({best['mean']:.1f}/5 over {best['count']})\n"
+        if len(combinations) > 1 and worst["mean"] < best["mean"]:
+            context += f"- Least liked: {worst['mood']} mood, {worst['personality']} personality ({worst['mean']:.1f}/5 over {worst['count']})\n"
+        complaints = self.feedback.top_complaints(person)
+        if complaints:
+            context += "- Frequent complaints: " + ", ".join(f"{term} ({count})" for term, count in complaints) + "\n"
+        for entry in self.feedback.recent(person, 2):
+            context += f"- Recent: {entry['feedback']} (Mood: {entry['mood']}, Rating: {entry['rating']}/5)\n"
+        for entry in related or []:
+            suggestion = truncate_to_tokens(entry['suggestion'] or "", RETRIEVAL_MESSAGE_TOKENS)
+            context += f"- On a similar suggestion (\"{suggestion}\"): {entry['feedback']} (Rating: {entry['rating']}/5)\n"
+        return context
+
+    def _embed(self, texts: List[str]) -> np.ndarray:
+        """Embed texts with the embedding model, one row per text."""
+        with self.metrics.span("embed", model=self.embed_model):
+            response = self.ollama_client.embed(model=self.embed_model, keep_alive=self.keep_alive,
+                                                input=[truncate_to_tokens(text, EMBED_MAX_TOKENS) for text in texts])
+        return np.asarray(response['embeddings'], dtype=np.float32)
+
+    def _embedding_failed(self, error: Exception):
+        if isinstance(error, ResponseError) and error.status_code < 500:
+            # Usually the embedding model isn't pulled; stop trying for this session
+            self.embed_error = str(error)
+
+    def _schedule_indexing(self, person: str):
+        """Embed a person's new messages and feedback in the background."""
+        if self.vector_index is not None and not self.embed_error:
+            self.index_queue.put(person)
+
+    def _index_worker(self):
+        self.local.background = True
+        while True:
+            person = self.index_queue.get()
+            try:
+                # Embed the query the person's next prompt will search with, so the request doesn't wait for it
+                self._query_vector("\n".join(self.conversations.tail(person, RETRIEVAL_QUERY_MESSAGES)))
+                self.index_person(person)
+            except Exception as e:
+                # Whatever wasn't embedded is picked up with the person's next message
+                self._embedding_failed(e)
+
+    def index_person(self, person: str, rebuild: bool = False, on_progress: Optional[Callable[[int], None]] = None) -> int:
+        """Embed a person's messages and feedback that aren't indexed yet, returning how many were added.
+
+        rebuild=True drops the person's embeddings first and indexes the full
+        history again. on_progress is called with the size of each batch.
+        """
+        if self.vector_index is None or person not in self.conversations:
+            return 0
+        with self.index_lock:
+            if rebuild:
+                self.vector_index.reset(person)
+                self.feedback_index.reset(person)
+            added = 0
+
+            def flush_messages(batch: List[str], offsets: List[int], indexed_bytes: int):
+                self.vector_index.append(person, self._embed(batch), offsets, indexed_bytes)
+                if on_progress:
+                    on_progress(len(batch))
+
+            batch, offsets = [], []
+            for offset, end, message in self.conversations.iter_from_offset(person, self.vector_index.meta(person)["indexed_bytes"]):
+                batch.append(message)
+                offsets.append(offset)
+                if len(batch) == EMBED_BATCH:
+                    flush_messages(batch, offsets, end)
+                    added += len(batch)
+                    batch, offsets = [], []
+            if batch:
+                flush_messages(batch, offsets, end)
+                added += len(batch)
+
+            while True:
+                entries = self.feedback.after(person, self.feedback_index.meta(person)["indexed_id"], EMBED_BATCH)
+                if not entries:
+                    break
+                vectors = self._embed([f"{e['suggestion'] or ''}\n{e['feedback'] or ''}" for e in entries])
+                self.feedback_index.append(person, vectors, [e["id"] for e in entries], entries[-1]["id"])
+                added += len(entries)
+                if on_progress:
+                    on_progress(len(entries))
+            return added
+
+    def _retrieve(self, person: str, recent_messages: List[str], feedback: bool = True) -> tuple:
+        """Find earlier messages and feedback related to the recent messages.
+
+        Only messages older than the recent window are searched, and the
+        feedback already shown as recent is skipped. Returns (messages in
+        chronological order, feedback entries), both empty when retrieval is
+        off or the embedding model is unavailable.
+        """
+        if self.vector_index is None or self.embed_error or not recent_messages:
+            return [], []
+        window_start = self.conversations.count(person) - len(recent_messages)
+        try:
+            with self.metrics.span("retrieve"):
+                query = self._query_vector("\n".join(recent_messages[-RETRIEVAL_QUERY_MESSAGES:]))
+                hits = self.vector_index.search(person, query, self.retrieve_k, window_start)
+                offsets = sorted(offset for score, offset in hits if score >= RETRIEVAL_MIN_SCORE)
+                messages = [truncate_to_tokens(m, RETRIEVAL_MESSAGE_TOKENS) for m in self.conversations.read_at(person, offsets)]
+                related_feedback = self._related_feedback(person, query) if feedback else []
+        except Exception as e:
+            self._embedding_failed(e)
+            return [], []
+        return messages, related_feedback
+
+    def _query_vector(self, query_text: str) -> np.ndarray:
+        """Embed a retrieval query, reusing the embedding of a recent or in-flight identical query."""
+        key = hashlib.blake2b(query_text.encode("utf-8"), digest_size=16).hexdigest()
+        with self.query_lock:
+            future = self.query_vectors.get(key)
+            owner = future is None
+            if owner:
+                future = self.query_vectors[key] = Future()
+                while len(self.query_vectors) > QUERY_CACHE_SIZE:
+                    self.query_vectors.popitem(last=False)
+            else:
+                self.query_vectors.move_to_end(key)
+        if owner:
+            try:
+                future.set_result(self._embed([query_text])[0])
+            except Exception as e:
+                with self.query_lock:
+                    if self.query_vectors.get(key) is future:
+                        del self.query_vectors[key]
+                future.set_exception(e)
+        return future.result()
+
+    def _related_feedback(self, person: str, query: np.ndarray) -> List[Dict]:
+        """Get the feedback entries most similar to query, skipping the most recent ones."""
+        recent_ids = {entry["id"] for entry in self.feedback.recent(person, 2)}
+        k = max(1, self.retrieve_k // 2)
+        hits = self.feedback_index.search(person, query, k + len(recent_ids))
+        ids = [key for score, key in hits if score >= RETRIEVAL_MIN_SCORE and key not in recent_ids][:k]
+        return self.feedback.by_ids(ids)
 
     def add_feedback(self, person: str, suggestion: str, feedback: str, rating: int, mood: str, personality: str, gender: str):
         """Add user feedback for a suggestion."""
-        if person not in self.feedback:
-            self.feedback[person] = []
-        self.feedback[person].append({
+        entry = {
             "suggestion": suggestion,
             "feedback": feedback,
             "rating": rating,
             "mood": mood,
             "personality": personality,
             "gender": gender,
+            "model": self.model,
             "timestamp": time.strftime("%Y-%m-%d %H:%M:%S")
-        })
-        self._save_feedback()
+        }
+        with self.metrics.span("persist_feedback"):
+            self.feedback.add(person, entry)
+        self.cancel_prefetch(person)
+        self._schedule_indexing(person)
+
+    def flush(self):
+        """Write buffered messages and feedback to disk now."""
+        if self.flusher is not None:
+            self.flusher.flush()
+        else:
+            self.conversations.flush()
+
+    def close(self):
+        """Write buffered messages and feedback and stop writing in the background."""
+        if self.flusher is not None:
+            self.flusher.close()
+        else:
+            self.conversations.flush()
 
-    def get_suggestions(self, person: str, mood: str, personality: str, gender: str, num_messages: int = 5) -> List[str]:
-        """Generate conversation suggestions using Ollama."""
+    def get_suggestions(self, person: str, mood: str, personality: str, gender: str, num_messages: Optional[int] = None, fresh: bool = False) -> List[Dict]:
+        """Generate conversation suggestions, each a {"text", "rationale"} dict, bypassing the cache if fresh is set."""
         if person not in self.conversations:
-            return ["I don't have any previous conversations with this person to base suggestions on."]
+            return [{"text": "I don't have any previous conversations with this person to base suggestions on.", "rationale": ""}]
+        
+        if num_messages is None and not fresh:
+            prefetched = self._take_prefetched(person, mood, personality, gender)
+            if prefetched is not None:
+                return prefetched
+        else:
+            # It can't be used, and would compete with this request for the model
+            self.cancel_prefetch(person)
         
-        recent_messages = self.conversations[person][-num_messages:]
-        feedback_context = self._get_feedback_context(person)
+        model = self.model_for("suggestions")
+        with self.metrics.request("get_suggestions", model=model):
+            try:
+                return self._suggest(person, mood, personality, gender, num_messages, fresh, model=model)
+            except Exception as e:
+                console.print(f"[red]Error generating suggestions: {str(e)}[/red]")
+                return [{"text": "I encountered an error while generating suggestions. Please try again.", "rationale": ""}]
+
+    def _suggest(self, person: str, mood: str, personality: str, gender: str, num_messages: Optional[int] = None, fresh: bool = False,
+                 on_token: Optional[Callable[[str], None]] = None, update_summary: bool = True, model: Optional[str] = None) -> List[Dict]:
+        """Build the prompt, call Ollama and parse the suggestions, raising on errors."""
+        model = model or self.model_for("suggestions")
+        # Generate prompt
+        with self.metrics.span("build_prompt", kind="suggestions"):
+            prompt = self._build_suggestion_prompt(person, mood, personality, gender, num_messages, update_summary)
+        
+        # Get response from Ollama
+        self.local.last_stats = None
+        response = self._generate(prompt, on_token=on_token, fresh=fresh, model=model, **self._suggestion_request())
+        self._record_latency(model, "suggestions")
         
+        with self.metrics.span("parse"):
+            suggestions = self._parse_suggestions(response, fallback=False)
+        if suggestions is None:
+            # Nothing usable, e.g. JSON not matching the schema: ask once more, bypassing the cached reply
+            response = self._generate(prompt, on_token=on_token, fresh=True, model=model, **self._suggestion_request())
+            with self.metrics.span("parse"):
+                suggestions = self._parse_suggestions(response)
+        return suggestions
+
+    def _prefetch_key(self, person: str, mood: str, personality: str, gender: str) -> tuple:
+        return (person, mood, personality, gender, self.model_for("suggestions", explore=False), self.conversations.count(person))
+
+    def prefetch_suggestions(self, person: str, mood: str, personality: str, gender: str):
+        """Start generating suggestions in the background so the next request can return them at once.
+
+        Only the latest request is kept: starting a new one cancels the previous
+        one, as do new messages, new feedback and cancel_prefetch().
+        """
+        if not self.prefetch or person not in self.conversations:
+            return
+        key = self._prefetch_key(person, mood, personality, gender)
+        with self.prefetch_lock:
+            if self.prefetch_job is not None and self.prefetch_job[0] == key:
+                return
+            self._cancel_prefetch_job()
+            self.prefetch_job = (key, Future(), threading.Event())
+            if self.prefetch_thread is None:
+                self.prefetch_thread = threading.Thread(target=self._prefetch_worker, daemon=True)
+                self.prefetch_thread.start()
+            self.prefetch_queue.put(self.prefetch_job)
+
+    def cancel_prefetch(self, person: Optional[str] = None):
+        """Cancel the pending speculative request, or only if it is for person."""
+        with self.prefetch_lock:
+            if self.prefetch_job is not None and person in (None, self.prefetch_job[0][0]):
+                self._cancel_prefetch_job()
+
+    def _cancel_prefetch_job(self):
+        if self.prefetch_job is not None:
+            _, future, cancelled = self.prefetch_job
+            cancelled.set()
+            future.cancel()
+            self.prefetch_job = None
+
+    def _take_prefetched(self, person: str, mood: str, personality: str, gender: str) -> Optional[List[Dict]]:
+        """Get the prefetched suggestions if they match the request, waiting if they are still being generated."""
+        with self.prefetch_lock:
+            job = self.prefetch_job
+            self.prefetch_job = None
+        if job is None:
+            return None
+        key, future, cancelled = job
+        if key != self._prefetch_key(person, mood, personality, gender):
+            cancelled.set()
+            future.cancel()
+            self.metrics.inc("prefetch_total", result="stale")
+            return None
         try:
-            # Generate prompt
-            prompt = self._generate_prompt(person, recent_messages, mood, personality, gender, feedback_context)
-            
-            # Get response from Ollama
-            response = self.ollama_client.generate(
-                model=self.model,
-                prompt=prompt,
-                stream=False
-            )
-            
-            # Parse the response into suggestions
-            suggestions = [s.strip() for s in response['response'].split('\n') if s.strip()]
-            
-            # If we got no suggestions, provide some fallback options
-            if not suggestions:
-                suggestions = [
-                    "Ask an open-ended question about their day",
-                    "Share a relevant personal experience",
-                    "Express interest in their opinions or perspective",
-                    "Ask about their plans or goals"
-                ]
-            
-            return suggestions
-            
-        except Exception as e:
-            console.print(f"[red]Error generating suggestions: {str(e)}[/red]")
-            return ["I encountered an error while generating suggestions. Please try again."]
+            suggestions, stats = future.result(timeout=PREFETCH_WAIT)
+        except TimeoutError:
+            # Probably stuck on an unresponsive endpoint; stop it at its next token if it ever streams one
+            cancelled.set()
+            future.cancel()
+            self.metrics.inc("prefetch_total", result="timeout")
+            return None
+        except Exception:
+            self.metrics.inc("prefetch_total", result="failed")
+            return None
+        self.metrics.inc("prefetch_total", result="hit")
+        if stats is not None:
+            self.call_stats.append(dict(stats, background=False, prefetched=True))
+        return suggestions
+
+    def _prefetch_worker(self):
+        """Run speculative suggestion requests one at a time."""
+        self.local.background = True
+        while True:
+            job = self.prefetch_queue.get()
+            key, future, cancelled = job
+            if cancelled.is_set() or not future.set_running_or_notify_cancel():
+                continue
+
+            def check_cancelled(token: str):
+                # Streaming lets a cancelled request stop Ollama mid-generation
+                if cancelled.is_set():
+                    raise PrefetchCancelled()
+
+            person, mood, personality, gender, model = key[:5]
+            try:
+                with self.metrics.request("prefetch_suggestions", model=model):
+                    # Leave summary updates to foreground requests
+                    suggestions = self._suggest(person, mood, personality, gender, on_token=check_cancelled,
+                                                update_summary=False, model=model)
+                future.set_result((suggestions, self.local.last_stats))
+            except PrefetchCancelled:
+                future.set_exception(RuntimeError("prefetch cancelled"))
+            except Exception as e:
+                future.set_exception(e)
 
-    def _generate_chat_prompt(self, person: str, recent_messages: List[str], mood: str, personality: str, gender: str) -> str:
+    def _build_suggestion_prompt(self, person: str, mood: str, personality: str, gender: str, num_messages: Optional[int] = None, update_summary: bool = True,
+                                 retrieve: bool = True) -> str:
+        """Build the suggestion prompt from the person's conversation context and feedback."""
+        summary, recent_messages = self._build_context(person, update_summary, num_messages)
+        related, related_feedback = self._retrieve(person, recent_messages) if retrieve else ([], [])
+        feedback_context = self._get_feedback_context(person, mood, personality, related_feedback)
+        return self._generate_prompt(person, recent_messages, mood, personality, gender, feedback_context, summary, related)
+
+    def _parse_suggestions(self, response: str, fallback: bool = True) -> Optional[List[Dict]]:
+        """Turn a raw LLM response into at most num_suggestions distinct {"text", "rationale"} suggestions.
+
+        JSON output is validated item by item, after repairing it if it doesn't
+        parse (text around it, trailing commas, truncation; a truncated last
+        item is dropped). A response without any JSON is split into list items
+        or lines. JSON without a single valid item is never shown as text: it
+        is counted as "invalid" and replaced by generic suggestions, or None
+        is returned if fallback is False so the caller can ask again.
+        """
+        items = []
+        method = "json"
+        is_json = False
+        if self.suggestion_format == "json":
+            try:
+                data, truncated = json.loads(response), False
+            except ValueError:
+                data, truncated = repair_json(response)
+                method = "repaired"
+            items = suggestion_items(data)
+            if truncated and len(items) > 1:
+                items = items[:-1]
+            is_json = data is not None or JSON_START.match(response) is not None
+        if not items and not is_json:
+            method = "lines"
+            items = [{"text": line, "rationale": ""} for line in split_suggestion_lines(response)]
+
+        suggestions = []
+        seen = set()
+        for item in items:
+            text = clean_suggestion_text(item["text"])
+            key = re.sub(r"\W+", " ", text.lower()).strip()
+            if key and key not in seen:
+                seen.add(key)
+                suggestions.append({"text": text, "rationale": item["rationale"]})
+        suggestions = suggestions[:self.num_suggestions]
+        # Duplicates, empty items and extras beyond num_suggestions
+        self.metrics.inc("suggestions_discarded_total", len(items) - len(suggestions))
+
+        # If we got no suggestions, provide some fallback options
+        if not suggestions:
+            method = "invalid" if is_json else "fallback"
+            if not fallback:
+                self.metrics.inc("suggestion_parse_total", method=method)
+                return None
+            suggestions = [{"text": text, "rationale": ""} for text in (
+                "Ask an open-ended question about their day",
+                "Share a relevant personal experience",
+                "Express interest in their opinions or perspective",
+                "Ask about their plans or goals"
+            )]
+        self.metrics.inc("suggestion_parse_total", method=method)
+        return suggestions
+
+    async def batch_suggestions(self, people: List[str], combinations: List[tuple], output_file: str,
+                                concurrency: int = 4, timeout: float = 120.0,
+                                on_progress: Optional[Callable[[Dict], None]] = None) -> Dict[str, int]:
+        """Precompute suggestions for every person and (mood, personality, gender) combination.
+
+        Requests are issued through an AsyncClient by a fixed number of workers so
+        the Ollama server stays busy without being flooded; with several servers
+        each request goes to the one with the fewest in flight. Each result is
+        written to output_file as one JSON line as soon as it completes.
+        """
+        if self.ollama_pool is not None:
+            clients = {endpoint: AsyncClient(host=endpoint.host) for endpoint in self.ollama_pool.endpoints}
+        else:
+            clients = {None: AsyncClient(host=self.host)}
+        jobs = asyncio.Queue()
+        for person in people:
+            if person not in self.conversations:
+                continue
+            for mood, personality, gender in combinations:
+                jobs.put_nowait((person, mood, personality, gender))
+        summary = {"total": jobs.qsize(), "succeeded": 0, "failed": 0}
+
+        with open(output_file, 'w') as out:
+            async def worker():
+                while True:
+                    try:
+                        person, mood, personality, gender = jobs.get_nowait()
+                    except asyncio.QueueEmpty:
+                        return
+                    record = {
+                        "person": person,
+                        "mood": mood,
+                        "personality": personality,
+                        "gender": gender,
+                        "model": self.model
+                    }
+                    start = time.perf_counter()
+                    try:
+                        # Summaries are only read here and nothing is embedded; those calls would block the event loop
+                        prompt = self._build_suggestion_prompt(person, mood, personality, gender, update_summary=False, retrieve=False)
+                        extra = self._suggestion_request()
+                        endpoint = self.ollama_pool.acquire() if self.ollama_pool is not None else None
+                        error = None
+                        call_start = time.perf_counter()
+                        try:
+                            response = await asyncio.wait_for(
+                                clients[endpoint].generate(model=self.model, prompt=prompt, stream=False, keep_alive=self.keep_alive, **extra),
+                                timeout
+                            )
+                        except Exception as e:
+                            error = e
+                            raise
+                        finally:
+                            if endpoint is not None:
+                                self.ollama_pool.release(endpoint, time.perf_counter() - call_start, error)
+                        record["suggestions"] = self._parse_suggestions(response['response'], fallback=False)
+                        if record["suggestions"] is None:
+                            raise ValueError("Response contained no valid suggestions")
+                        summary["succeeded"] += 1
+                        # Warm the response cache so interactive sessions can reuse the result
+                        if self.response_cache is not None and response['response'].strip():
+                            self.response_cache.put(self.response_cache.make_key(self.model, self._cache_text(prompt, extra)), response['response'])
+                    except Exception as e:
+                        record["error"] = str(e) or type(e).__name__
+                        summary["failed"] += 1
+                    record["elapsed"] = round(time.perf_counter() - start, 3)
+                    record["timestamp"] = time.strftime("%Y-%m-%d %H:%M:%S")
+                    out.write(json.dumps(record) + "\n")
+                    out.flush()
+                    if on_progress:
+                        on_progress(record)
+
+            await asyncio.gather(*(worker() for _ in range(max(1, concurrency))))
+        return summary
+
+    def _generate_chat_prompt(self, person: str, recent_messages: List[str], mood: str, personality: str, gender: str, summary: str = "",
+                              related: Optional[List[str]] = None) -> str:
         """Generate a prompt for the LLM to act as a chatbot."""
         base_prompt = f"""You are a helpful AI chatbot having a conversation with {person}. Respond naturally and engagingly to the user's messages.
 
@@ -187,7 +2346,7 @@ Personality guidelines: {self.personality_types[personality]}
 
 Gender preference: {gender}
 Gender guidelines: {self.gender_preferences[gender]}
-
+{self._format_summary(summary)}{self._format_related(related)}
 Recent messages:
 {chr(10).join(recent_messages)}
 
@@ -195,52 +2354,300 @@ Respond as a chatbot in a natural, conversational way. Keep your response concis
 
         return base_prompt
 
-    def chat_with_ai(self, person: str, mood: str, personality: str, gender: str) -> str:
-        """Generate a chatbot response using Ollama."""
+    def _generate_chat_system_prompt(self, person: str, mood: str, personality: str, gender: str) -> str:
+        """Generate the static system block used by session chat mode."""
+        return f"""You are a helpful AI chatbot having a conversation with {person}. Respond naturally and engagingly to the user's messages.
+
+Conversation mood: {mood}
+Mood guidelines: {self.moods[mood]}
+
+Personality type: {personality}
+Personality guidelines: {self.personality_types[personality]}
+
+Gender preference: {gender}
+Gender guidelines: {self.gender_preferences[gender]}
+
+Respond as a chatbot in a natural, conversational way. Keep your response concise and engaging."""
+
+    def _chat_session_turn(self, person: str, mood: str, personality: str, gender: str, on_token: Optional[Callable[[str], None]], fresh: bool,
+                           model: str) -> str:
+        """Send only the messages added since the last turn through the chat API.
+
+        The system block and earlier turns are resent byte-for-byte, so Ollama
+        can reuse the KV cache for that prefix while the model is kept loaded
+        with keep_alive. The session restarts when the settings change or it
+        grows past SESSION_MAX_MESSAGES.
+        """
+        settings = (model, mood, personality, gender)
+        total = self.conversations.count(person)
+        session = self.chat_sessions.get(person)
+        if session is None or session["settings"] != settings or len(session["messages"]) > SESSION_MAX_MESSAGES:
+            with self.metrics.span("build_prompt", kind="chat_session"):
+                summary, recent_messages = self._build_context(person)
+            session = {
+                "settings": settings,
+                "messages": [{"role": "system", "content": self._generate_chat_system_prompt(person, mood, personality, gender)}],
+                "synced": total - len(recent_messages),
+                "pending_reply": None
+            }
+            if summary:
+                session["messages"].append({"role": "user", "content": self._format_summary(summary).strip()})
+            self.chat_sessions[person] = session
+        new_messages = self.conversations.tail(person, total - session["synced"])
+        if new_messages and new_messages[0] == session["pending_reply"]:
+            # Our previous reply, recorded by the caller; it is already in the session
+            new_messages = new_messages[1:]
+        if new_messages:
+            session["messages"].append({"role": "user", "content": "\n".join(new_messages)})
+        elif session["messages"][-1]["role"] == "assistant":
+            # Nothing new since the last turn: reuse its reply, or regenerate it if fresh is set
+            if not fresh:
+                return session["messages"][-1]["content"]
+            session["messages"].pop()
+        try:
+            response = self._chat(session["messages"], on_token=on_token, fresh=fresh, model=model).strip()
+        except Exception:
+            del self.chat_sessions[person]
+            raise
+        session["messages"].append({"role": "assistant", "content": response})
+        session["synced"] = total
+        session["pending_reply"] = response
+        return response
+
+    def chat_with_ai(self, person: str, mood: str, personality: str, gender: str, on_token: Optional[Callable[[str], None]] = None, fresh: bool = False) -> str:
+        """Generate a chatbot response using Ollama, streaming tokens to on_token if given."""
         if person not in self.conversations:
             return "Hello! I'm happy to chat with you. How can I help you today?"
         
-        recent_messages = self.conversations[person][-5:]  # Use last 5 messages for context
+        model = self.model_for("chat")
+        with self.metrics.request("chat_with_ai", model=model, mode=self.chat_mode):
+            try:
+                return self._respond(person, mood, personality, gender, on_token, fresh, model)
+            except Exception as e:
+                console.print(f"[red]Error generating response: {str(e)}[/red]")
+                return "I encountered an error. Please try again."
+
+    def _respond(self, person: str, mood: str, personality: str, gender: str, on_token: Optional[Callable[[str], None]] = None, fresh: bool = False,
+                 model: Optional[str] = None) -> str:
+        """Generate the chatbot's reply in the configured chat mode, raising on errors."""
+        model = model or self.model_for("chat")
+        self.local.last_stats = None
+        if self.chat_mode == "session":
+            response = self._chat_session_turn(person, mood, personality, gender, on_token, fresh, model)
+            self._record_latency(model, "chat")
+            return response
         
-        try:
-            # Generate prompt
-            prompt = self._generate_chat_prompt(person, recent_messages, mood, personality, gender)
-            
-            # Get response from Ollama
-            response = self.ollama_client.generate(
-                model=self.model,
-                prompt=prompt,
-                stream=False
-            )
-            
-            return response['response'].strip()
-            
-        except Exception as e:
-            console.print(f"[red]Error generating response: {str(e)}[/red]")
-            return "I encountered an error. Please try again."
+        # Generate prompt
+        with self.metrics.span("build_prompt", kind="chat"):
+            summary, recent_messages = self._build_context(person)
+            related, _ = self._retrieve(person, recent_messages, feedback=False)
+            prompt = self._generate_chat_prompt(person, recent_messages, mood, personality, gender, summary, related)
+        
+        # Get response from Ollama
+        self.local.last_stats = None
+        response = self._generate(prompt, on_token=on_token, fresh=fresh, model=model)
+        self._record_latency(model, "chat")
+        
+        return response.strip()
 
     def change_model(self, model_name: str):
-        """Change the current model."""
+        """Change the current model, or switch to per-task routing with "auto"."""
+        if model_name == "auto":
+            self.cancel_prefetch()
+            self.auto_model = True
+            return True
         if model_name in self.available_models:
+            self.cancel_prefetch()
             self.model = model_name
+            self.auto_model = False
+            if self.preload:
+                self.preload_model(model_name)
             return True
         return False
 
     def get_model_info(self) -> str:
         """Get information about the current model."""
+        if self.auto_model:
+            return f"auto - suggestions: {self.model_for('suggestions', explore=False)}, chat: {self.model_for('chat', explore=False)}"
         return f"{self.model} - {self.available_models[self.model]}"
 
-def display_suggestions(suggestions: List[str], mood: str, personality: str, gender: str):
+    def preload_model(self, model: Optional[str] = None):
+        """Load a model into Ollama's memory in the background so the first request doesn't wait for it.
+
+        A request with an empty prompt makes Ollama load the model without
+        generating anything, and keep_alive then keeps it loaded. With several
+        servers each of them loads it.
+        """
+        model = model or self.model
+        if self.model_loads.get(model, {}).get("status") == "loading":
+            return
+        self.model_loads[model] = {"status": "loading", "seconds": None}
+        clients = [endpoint.client for endpoint in self.ollama_pool.endpoints] if self.ollama_pool else [self.ollama_client]
+
+        def load():
+            start = time.perf_counter()
+            try:
+                with self.metrics.span("model_load", model=model):
+                    for client in clients:
+                        client.generate(model=model, prompt="", keep_alive=self.keep_alive)
+            except Exception as e:
+                self.model_loads[model] = {"status": "failed", "seconds": None, "error": str(e)}
+            else:
+                self.model_loads[model] = {"status": "ready", "seconds": time.perf_counter() - start}
+
+        threading.Thread(target=load, daemon=True).start()
+
+    def _record_latency(self, model: str, task: str):
+        """Add the latency of this thread's last uncached call to the model's rolling record."""
+        stats = self.local.last_stats
+        if stats is None or stats["cached"]:
+            return
+        latency = stats["time_to_first_token"] if task == "chat" else stats["total_time"]
+        if latency is not None:
+            self.model_latency.setdefault((model, task), deque(maxlen=LATENCY_WINDOW)).append(latency)
+
+    def model_report(self) -> Dict[str, Dict]:
+        """Get each model's median latency per task, feedback rating and preload status."""
+        ratings = self.feedback.model_stats()
+        report = {}
+        for model in self.available_models:
+            entry = {
+                "rating": ratings.get(model, {}).get("mean"),
+                "ratings": ratings.get(model, {}).get("count", 0),
+                "load": self.model_loads.get(model)
+            }
+            for task in AUTO_ROUTING:
+                samples = sorted(self.model_latency.get((model, task), ()))
+                entry[task] = samples[len(samples) // 2] if samples else None
+            report[model] = entry
+        return report
+
+    def model_for(self, task: str, explore: bool = True) -> str:
+        """Get the model to use for "chat" or "suggestions".
+
+        In auto mode this is the model with the best mix of speed and feedback
+        ratings for the task among those measured so far. Models known to be
+        usable (the selected one, ones that preloaded or answered before, and
+        ones with ratings from earlier sessions) get AUTO_EXPLORE of the calls
+        until they have LATENCY_WINDOW latency samples for the task, so an
+        alternative is measured before it can be picked. Models without a
+        sign of being pulled are never tried. explore=False gets the best
+        model only, e.g. to describe or match a request.
+        """
+        if not self.auto_model:
+            return self.model
+        routing = AUTO_ROUTING[task]
+        weight = routing["latency_weight"]
+        best, best_score = self.model, None
+        report = self.model_report()
+        for model, entry in report.items():
+            latency = entry[task]
+            if latency is None and model != self.model:
+                continue
+            quality = (entry["rating"] - 1) / 4 if entry["ratings"] >= AUTO_MIN_RATINGS else 0.5
+            speed = routing["target"] / (routing["target"] + latency) if latency is not None else 0.5
+            score = (1 - weight) * quality + weight * speed
+            if best_score is None or score > best_score:
+                best, best_score = model, score
+        candidates = [model for model, entry in report.items()
+                      if model != best and len(self.model_latency.get((model, task), ())) < LATENCY_WINDOW
+                      and (model == self.model or entry[task] is not None or entry["ratings"] > 0
+                           or (entry["load"] or {}).get("status") == "ready")]
+        if explore and candidates and random.random() < AUTO_EXPLORE:
+            return min(candidates, key=lambda model: len(self.model_latency.get((model, task), ())))
+        return best
+
+def display_suggestions(suggestions: List[Dict], mood: str, personality: str, gender: str):
     """Display suggestions in a nice format."""
     table = Table(title=f"Conversation Suggestions (Mood: {mood}, Personality: {personality}, Gender: {gender})")
     table.add_column("Number", style="cyan")
     table.add_column("Suggestion", style="green")
+    show_rationale = any(suggestion["rationale"] for suggestion in suggestions)
+    if show_rationale:
+        table.add_column("Why", style="dim")
     
     for i, suggestion in enumerate(suggestions, 1):
-        table.add_row(str(i), suggestion)
+        table.add_row(str(i), suggestion["text"], *([suggestion["rationale"]] if show_rationale else []))
     
     console.print(table)
 
+def print_call_stats(stats: Optional[Dict]):
+    """Print latency stats of an LLM call."""
+    if not stats or stats["time_to_first_token"] is None:
+        return
+    if stats["cached"]:
+        console.print(f"[dim]{stats['model']} · cached response[/dim]")
+        return
+    if stats.get("prefetched"):
+        console.print(f"[dim]{stats['model']} · prefetched in the background in {stats['total_time']:.2f}s[/dim]")
+        return
+    line = f"{stats['model']} · first token {stats['time_to_first_token']:.2f}s · total {stats['total_time']:.2f}s"
+    if stats["prompt_eval_count"] is not None:
+        line += f" · {stats['prompt_eval_count']} prompt tokens"
+    if stats["tokens_per_sec"]:
+        line += f" · {stats['tokens_per_sec']:.1f} tok/s"
+    console.print(f"[dim]{line}[/dim]")
+
+def print_stats(suggester: ConversationSuggester):
+    """Print per-stage latency and counters collected this session."""
+    rows = suggester.metrics.stage_summary()
+    if not rows:
+        console.print("[yellow]No requests measured yet.[/yellow]")
+        return
+    table = Table(title="Latency by stage (ms)")
+    table.add_column("Stage", style="cyan")
+    table.add_column("Labels", style="dim")
+    for column in ("Count", "Mean", "p50", "p95", "Max"):
+        table.add_column(column, justify="right", style="green")
+    for row in rows:
+        labels = ", ".join(f"{k}={v}" for k, v in row["labels"].items())
+        table.add_row(row["stage"], labels, str(row["count"]),
+                      *(f"{row[k] * 1000:.1f}" for k in ("mean", "p50", "p95", "max")))
+    console.print(table)
+
+    metrics = suggester.metrics
+    prompt_tokens = metrics.counter_totals("prompt_tokens_total", "model")
+    completion_tokens = metrics.counter_totals("completion_tokens_total", "model")
+    for model in sorted(set(prompt_tokens) | set(completion_tokens)):
+        console.print(f"[bold]Tokens ({model}):[/bold] {int(prompt_tokens.get(model, 0))} prompt, {int(completion_tokens.get(model, 0))} completion")
+    lookups = metrics.counter_totals("cache_lookups_total", "result")
+    if lookups:
+        total = sum(lookups.values())
+        console.print(f"[bold]Cache:[/bold] {int(lookups.get('hit', 0))}/{int(total)} hits ({lookups.get('hit', 0) / total:.0%})")
+    prefetches = metrics.counter_totals("prefetch_total", "result")
+    if prefetches:
+        console.print(f"[bold]Prefetch:[/bold] {int(prefetches.get('hit', 0))}/{int(sum(prefetches.values()))} used")
+    if suggester.ollama_pool is not None:
+        pool = suggester.ollama_pool
+        for endpoint in pool.status():
+            latency = f"{endpoint['latency']:.2f}s avg" if endpoint["latency"] is not None else "no requests yet"
+            state = "healthy" if endpoint["healthy"] else "[red]ejected[/red]"
+            console.print(f"[bold]{endpoint['host']}:[/bold] {state}, {endpoint['requests']} requests, {endpoint['outstanding']} in flight, {latency}")
+        if pool.hedge_after:
+            console.print(f"[bold]Hedged requests:[/bold] {pool.hedges} ({pool.hedge_wins} answered first by the second server)")
+    errors = metrics.counter_totals("errors_total", "stage")
+    retries = metrics.counter_totals("retries_total", "endpoint")
+    console.print(f"[bold]Errors:[/bold] {int(sum(errors.values()))}"
+                  + (" (" + ", ".join(f"{k}: {int(v)}" for k, v in errors.items()) + ")" if errors else "")
+                  + f" · [bold]Retries:[/bold] {int(sum(retries.values()))}")
+
+def stream_chat_response(suggester: ConversationSuggester, person: str, mood: str, personality: str, gender: str) -> str:
+    """Render the AI response token by token as it is generated."""
+    reply = Text.from_markup("\n[bold blue]AI[/bold blue]: ")
+    prefix_length = len(reply)
+    with Live(Spinner("dots", text=Text("Thinking...", style="bold blue")), console=console, refresh_per_second=15) as live:
+        def render_token(token: str):
+            reply.append(token)
+            live.update(reply)
+
+        response = suggester.chat_with_ai(person, mood, personality, gender, on_token=render_token)
+        if reply.plain[prefix_length:].strip() != response:
+            # Nothing was streamed (cached greeting or error), show the final text instead
+            reply.right_crop(len(reply) - prefix_length)
+            reply.append(response)
+            live.update(reply)
+    return response
+
 def select_mood(suggester: ConversationSuggester) -> str:
     """Let user select a mood for the conversation."""
     console.print("\n[bold]Select the mood for your conversation:[/bold]")
@@ -289,9 +2696,27 @@ def select_gender(suggester: ConversationSuggester) -> str:
 def select_model(suggester: ConversationSuggester) -> str:
     """Let user select a model for the conversation."""
     console.print("\n[bold]Select the AI model:[/bold]")
-    model_choices = list(suggester.available_models.keys())
+    model_choices = list(suggester.available_models.keys()) + ["auto"]
+    report = suggester.model_report()
     for i, model in enumerate(model_choices, 1):
+        if model == "auto":
+            console.print(f"{i}. auto - Pick the model per task from measured latency and ratings")
+            continue
         console.print(f"{i}. {model} - {suggester.available_models[model]}")
+        entry = report[model]
+        details = []
+        if entry["chat"] is not None:
+            details.append(f"chat first token {entry['chat']:.2f}s")
+        if entry["suggestions"] is not None:
+            details.append(f"suggestions {entry['suggestions']:.2f}s")
+        if entry["ratings"]:
+            details.append(f"rated {entry['rating']:.1f}/5 ({entry['ratings']})")
+        if entry["load"] and entry["load"]["status"] == "ready":
+            details.append(f"loaded in {entry['load']['seconds']:.1f}s")
+        elif entry["load"]:
+            details.append(entry["load"]["status"])
+        if details:
+            console.print(f"   [dim]{' · '.join(details)}[/dim]")
     while True:
         try:
             choice = int(Prompt.ask("\nChoose a model (enter number)", default="1"))
@@ -312,9 +2737,213 @@ def get_user_feedback(suggester: ConversationSuggester, person: str, suggestion:
     suggester.add_feedback(person, suggestion, feedback, int(rating), mood, personality, gender)
     return True
 
+def parse_choices(value: str, available: Dict[str, str], label: str) -> List[str]:
+    """Parse a comma-separated list of settings, accepting 'all'."""
+    if value == "all":
+        return list(available.keys())
+    choices = [v.strip() for v in value.split(",") if v.strip()]
+    unknown = [c for c in choices if c not in available]
+    if unknown:
+        raise SystemExit(f"Unknown {label}: {', '.join(unknown)}")
+    return choices
+
+def run_batch(suggester: ConversationSuggester, args: argparse.Namespace):
+    """Precompute suggestions for many people and setting combinations."""
+    if args.model and not suggester.change_model(args.model):
+        raise SystemExit(f"Unknown model: {args.model}")
+    people = [p.strip() for p in args.people.split(",")] if args.people else list(suggester.conversations.keys())
+    moods = parse_choices(args.moods, suggester.moods, "mood")
+    personalities = parse_choices(args.personalities, suggester.personality_types, "personality")
+    genders = parse_choices(args.genders, suggester.gender_preferences, "gender")
+    combinations = [(m, p, g) for m in moods for p in personalities for g in genders]
+    total = sum(len(combinations) for person in people if person in suggester.conversations)
+
+    with Progress(TextColumn("[bold blue]{task.description}"), BarColumn(), MofNCompleteColumn(),
+                  TimeElapsedColumn(), console=console) as progress:
+        task = progress.add_task("Generating suggestions", total=total)
+
+        def on_progress(record: Dict):
+            if "error" in record:
+                progress.console.print(f"[red]{record['person']} ({record['mood']}/{record['personality']}/{record['gender']}): {record['error']}[/red]")
+            progress.advance(task)
+
+        summary = asyncio.run(suggester.batch_suggestions(
+            people, combinations, args.output,
+            concurrency=args.concurrency, timeout=args.timeout, on_progress=on_progress
+        ))
+    console.print(f"[green]{summary['succeeded']}/{summary['total']} suggestion sets written to {args.output}[/green]")
+    if summary["failed"]:
+        console.print(f"[yellow]{summary['failed']} requests failed or timed out.[/yellow]")
+
+def run_reindex(suggester: ConversationSuggester, args: argparse.Namespace):
+    """Embed conversation history and feedback in bulk."""
+    if suggester.vector_index is None:
+        raise SystemExit("Retrieval is disabled (--retrieve-k 0)")
+    people = [p.strip() for p in args.people.split(",")] if args.people else list(suggester.conversations.keys())
+    people = [person for person in people if person in suggester.conversations]
+    if args.incremental:
+        total = sum(suggester.conversations.count(person) - suggester.vector_index.meta(person)["count"]
+                    + suggester.feedback.count_after(person, suggester.feedback_index.meta(person)["indexed_id"])
+                    for person in people)
+    else:
+        total = sum(suggester.conversations.count(person) + suggester.feedback.count(person) for person in people)
+    start = time.perf_counter()
+    added = 0
+    with Progress(TextColumn("[bold blue]{task.description}"), BarColumn(), MofNCompleteColumn(),
+                  TimeElapsedColumn(), console=console) as progress:
+        task = progress.add_task(f"Embedding with {suggester.embed_model}", total=total)
+        for person in people:
+            try:
+                added += suggester.index_person(person, rebuild=not args.incremental,
+                                                on_progress=lambda n: progress.advance(task, n))
+            except Exception as e:
+                raise SystemExit(f"Indexing {person} failed: {e}")
+    elapsed = time.perf_counter() - start
+    console.print(f"[green]Embedded {added} messages and feedback entries for {len(people)} people "
+                  f"in {elapsed:.1f}s ({added / elapsed if elapsed else 0:.0f}/s).[/green]")
+
+def run_import(suggester: ConversationSuggester, args: argparse.Namespace):
+    """Stream an exported chat log into the conversation history."""
+    from importer import checkpoint_path, import_file
+    if not os.path.isfile(args.file):
+        raise SystemExit(f"No such file: {args.file}")
+    checkpoint_file = args.checkpoint or checkpoint_path(args.data_dir, args.file)
+    start = time.perf_counter()
+    with Progress(TextColumn("[bold blue]{task.description}"), BarColumn(), DownloadColumn(),
+                  TextColumn("{task.fields[rate]}"), TimeElapsedColumn(), console=console) as progress:
+        task = progress.add_task(f"Importing {os.path.basename(args.file)}", total=os.path.getsize(args.file), rate="")
+
+        def on_progress(offset: int, totals: Dict, read: int):
+            elapsed = time.perf_counter() - start
+            progress.update(task, completed=offset, rate=f"{read / elapsed if elapsed else 0:,.0f} msg/s")
+
+        try:
+            totals = import_file(suggester, args.file, args.format, args.person, args.batch_size, checkpoint_file,
+                                 args.restart, on_progress)
+        except ValueError as e:
+            raise SystemExit(f"Import failed: {e}")
+        except KeyboardInterrupt:
+            raise SystemExit("Import interrupted; run the same command again to continue where it stopped.")
+    elapsed = time.perf_counter() - start
+    console.print(f"[green]{'Resumed import: ' if totals['resumed'] else ''}{totals['messages']:,} messages imported for "
+                  f"{totals['people']:,} people, {totals['duplicates']:,} already present, {totals['skipped']:,} skipped. "
+                  f"Read {totals['read']:,} records in {elapsed:.1f}s ({totals['read'] / elapsed if elapsed else 0:,.0f}/s).[/green]")
+    if args.retrieve_k > 0 and totals["messages"]:
+        console.print("[dim]Run `reindex --incremental` to embed the imported messages for retrieval.[/dim]")
+
+def run_server(suggester: ConversationSuggester, args: argparse.Namespace):
+    """Serve the HTTP API."""
+    from server import serve
+    if args.model and not suggester.change_model(args.model):
+        raise SystemExit(f"Unknown model: {args.model}")
+    serve(suggester, args.bind, args.port, args.workers, args.queue_size, args.timeout)
+
 def main():
-    suggester = ConversationSuggester()
-    
+    parser = argparse.ArgumentParser(description="AI chatbot with conversation suggestions")
+    parser.add_argument("--host", help="Ollama server URL (default: OLLAMA_HOST or http://localhost:11434)")
+    parser.add_argument("--hosts", help="Comma-separated Ollama server URLs to spread requests over")
+    parser.add_argument("--hedge-after", type=float,
+                        help="Also send a request to a second server if the first gives no output within this many seconds")
+    parser.add_argument("--data-dir", default=".", help="Directory holding conversation and feedback data")
+    parser.add_argument("--durability", choices=["async", "sync"], default="async",
+                        help="Write new messages and feedback in the background, or to disk before continuing")
+    parser.add_argument("--flush-interval", type=float, default=1.0,
+                        help="Seconds changes are collected before a background write (with --durability async)")
+    parser.add_argument("--chat-mode", choices=["stateless", "session"], default="stateless",
+                        help="Rebuild the chat prompt every turn, or keep a chat session so Ollama can reuse its cache")
+    parser.add_argument("--keep-alive", default="30m", help="How long Ollama keeps the model loaded between requests")
+    parser.add_argument("--no-preload", dest="preload", action="store_false",
+                        help="Don't load the selected model in the background at startup and when switching models")
+    parser.add_argument("--context-tokens", type=int, default=1024,
+                        help="Token budget for conversation context; older messages are summarized")
+    parser.add_argument("--num-suggestions", type=int, default=4, help="Suggestions generated per request")
+    parser.add_argument("--temperature", type=float, help="Sampling temperature for suggestions (default: the model's)")
+    parser.add_argument("--suggestion-format", choices=["json", "text"], default="json",
+                        help="Ask for schema-constrained JSON suggestions with a rationale, or a plain list")
+    parser.add_argument("--embed-model", default="nomic-embed-text", help="Ollama model used to embed messages for retrieval")
+    parser.add_argument("--retrieve-k", type=int, default=4,
+                        help="Related earlier messages added to prompts (0 disables embedding and retrieval)")
+    parser.add_argument("--trace-file", help="Append a JSON line per timed stage to this file")
+    parser.add_argument("--metrics-file", help="Write Prometheus text-format metrics to this file")
+    parser.add_argument("--metrics-port", type=int, help="Serve Prometheus metrics on http://127.0.0.1:PORT/metrics")
+    parser.add_argument("--no-prefetch", dest="prefetch", action="store_false",
+                        help="Don't generate suggestions in the background after each chat turn")
+    parser.add_argument("--cache-size", type=int, default=256, help="Responses kept in the in-memory cache (0 disables caching)")
+    parser.add_argument("--cache-ttl", type=float, default=3600, help="Seconds before a cached response expires (0 keeps them forever)")
+    parser.add_argument("--cache-dir", help="Directory for a persistent on-disk response cache")
+    parser.add_argument("--cache-disk-entries", type=int, default=10000,
+                        help="Most responses kept in --cache-dir before the oldest are removed (0 for no limit)")
+    subparsers = parser.add_subparsers(dest="command")
+    batch_parser = subparsers.add_parser("batch", help="Precompute suggestions for many people and settings")
+    batch_parser.add_argument("--people", help="Comma-separated people (default: everyone with a conversation)")
+    batch_parser.add_argument("--moods", default="casual", help="Comma-separated moods, or 'all'")
+    batch_parser.add_argument("--personalities", default="ambivert", help="Comma-separated personality types, or 'all'")
+    batch_parser.add_argument("--genders", default="any", help="Comma-separated gender preferences, or 'all'")
+    batch_parser.add_argument("--model", help="Model to use (default: mistral)")
+    batch_parser.add_argument("--concurrency", type=int, default=4, help="Maximum requests in flight")
+    batch_parser.add_argument("--timeout", type=float, default=120.0, help="Per-request timeout in seconds")
+    batch_parser.add_argument("--output", default="batch_suggestions.jsonl", help="JSONL file to write results to")
+    reindex_parser = subparsers.add_parser("reindex", help="Rebuild the embedding index used to find related messages")
+    reindex_parser.add_argument("--people", help="Comma-separated people (default: everyone with a conversation)")
+    reindex_parser.add_argument("--incremental", action="store_true", help="Only embed messages and feedback not indexed yet")
+    import_parser = subparsers.add_parser("import", help="Import an exported chat log into the conversation history")
+    import_parser.add_argument("file", help="Exported chat log (plain text, JSON Lines or JSON)")
+    import_parser.add_argument("--format", choices=["auto", "text", "jsonl", "json"], default="auto",
+                               help="Input format (default: from the file extension)")
+    import_parser.add_argument("--person", help="Person to file messages under when the input doesn't name one")
+    import_parser.add_argument("--batch-size", type=int, default=5000, help="Records read between writes and checkpoints")
+    import_parser.add_argument("--checkpoint", help="Checkpoint file (default: under DATA_DIR/imports)")
+    import_parser.add_argument("--restart", action="store_true", help="Ignore an existing checkpoint and start from the beginning")
+    serve_parser = subparsers.add_parser("serve", help="Serve suggestions and chat over an HTTP/JSON API")
+    serve_parser.add_argument("--bind", default="127.0.0.1", help="Address to listen on")
+    serve_parser.add_argument("--port", type=int, default=8000, help="Port to listen on")
+    serve_parser.add_argument("--workers", type=int, default=4, help="Requests sent to Ollama at the same time")
+    serve_parser.add_argument("--queue-size", type=int, default=32, help="Requests waiting for a worker before new ones get 503")
+    serve_parser.add_argument("--timeout", type=float, default=120.0, help="Seconds a client waits for a response")
+    serve_parser.add_argument("--model", help="Model to use (default: mistral)")
+    args = parser.parse_args()
+
+    suggester = ConversationSuggester(cache_size=args.cache_size, cache_ttl=args.cache_ttl, cache_dir=args.cache_dir,
+                                      cache_disk_entries=args.cache_disk_entries,
+                                      data_dir=args.data_dir, chat_mode=args.chat_mode, keep_alive=args.keep_alive,
+                                      context_tokens=args.context_tokens, host=args.host,
+                                      metrics=Metrics(args.trace_file, args.metrics_file), prefetch=args.prefetch,
+                                      hosts=[h.strip() for h in args.hosts.split(",") if h.strip()] if args.hosts else None,
+                                      hedge_after=args.hedge_after, preload=args.preload,
+                                      # Imported history is embedded afterwards with reindex, not message by message
+                                      embed_model=args.embed_model, retrieve_k=0 if args.command == "import" else args.retrieve_k,
+                                      durability=args.durability, flush_interval=args.flush_interval,
+                                      num_suggestions=args.num_suggestions, temperature=args.temperature,
+                                      suggestion_format=args.suggestion_format)
+    # Leave through the finally below on termination so buffered changes are written
+    for name in ("SIGTERM", "SIGHUP"):
+        if hasattr(signal, name):
+            signal.signal(getattr(signal, name), exit_on_signal)
+    suggester.metrics.start_export(port=args.metrics_port)
+    if args.preload and args.command not in ("reindex", "import") and not getattr(args, "model", None):
+        # Commands given --model preload it when they switch to it
+        suggester.preload_model()
+    try:
+        if args.command == "batch":
+            run_batch(suggester, args)
+        elif args.command == "serve":
+            run_server(suggester, args)
+        elif args.command == "reindex":
+            run_reindex(suggester, args)
+        elif args.command == "import":
+            run_import(suggester, args)
+        else:
+            run_interactive(suggester)
+    finally:
+        suggester.close()
+        suggester.metrics.close()
+
+def exit_on_signal(signum: int, frame):
+    """Exit normally, so cleanup runs, when the process is asked to terminate."""
+    raise SystemExit(128 + signum)
+
+def run_interactive(suggester: ConversationSuggester):
+    """Run the interactive chatbot loop."""
     console.print(Panel.fit(
         "[bold blue]Welcome to the AI Chatbot![/bold blue]\n"
         "I'll help you have engaging conversations. Type 'exit' to quit, 'help' for commands.",
@@ -329,7 +2958,9 @@ def main():
     if suggester.conversations:
         console.print("\n[bold]Existing conversations:[/bold]")
         for i, person in enumerate(suggester.conversations.keys(), 1):
-            console.print(f"{i}. {person}")
+            info = suggester.conversations.info(person)
+            last_activity = f", last active {info['last_activity']}" if info["last_activity"] else ""
+            console.print(f"{i}. {person} [dim]({info['count']} messages{last_activity})[/dim]")
         
         console.print("\n[bold]Options:[/bold]")
         console.print("1. Select existing conversation")
@@ -368,7 +2999,10 @@ def main():
     console.print("- [cyan]personality[/cyan]: Change personality type")
     console.print("- [cyan]gender[/cyan]: Change gender preference")
     console.print("- [cyan]suggestions[/cyan]: Get conversation suggestions")
+    console.print("- [cyan]suggestions fresh[/cyan]: Get new suggestions, bypassing the response cache")
     console.print("- [cyan]history[/cyan]: View conversation history")
+    console.print("- [cyan]cache[/cyan]: Show response cache hit/miss counters")
+    console.print("- [cyan]stats[/cyan]: Show latency, token and error statistics for this session")
     console.print("- [cyan]chat[/cyan]: Start chatting with AI")
     console.print("- [cyan]quit[/cyan]: End current conversation and start new one")
     console.print("- [cyan]exit[/cyan]: Exit the program")
@@ -381,6 +3015,8 @@ def main():
             break
         elif user_input.lower() == 'quit':
             console.print("[yellow]Ending current conversation...[/yellow]")
+            suggester.cancel_prefetch()
+            suggester.flush()
             person = Prompt.ask("\nWho would you like to chat with?")
             continue
         elif user_input.lower() == 'help':
@@ -391,7 +3027,10 @@ def main():
             console.print("- [cyan]personality[/cyan]: Change personality type")
             console.print("- [cyan]gender[/cyan]: Change gender preference")
             console.print("- [cyan]suggestions[/cyan]: Get conversation suggestions")
+            console.print("- [cyan]suggestions fresh[/cyan]: Get new suggestions, bypassing the response cache")
             console.print("- [cyan]history[/cyan]: View conversation history")
+            console.print("- [cyan]cache[/cyan]: Show response cache hit/miss counters")
+            console.print("- [cyan]stats[/cyan]: Show latency, token and error statistics for this session")
             console.print("- [cyan]chat[/cyan]: Start chatting with AI")
             console.print("- [cyan]quit[/cyan]: End current conversation and start new one")
             console.print("- [cyan]exit[/cyan]: Exit the program")
@@ -405,37 +3044,58 @@ def main():
             continue
         elif user_input.lower() == 'mood':
             mood = select_mood(suggester)
+            suggester.cancel_prefetch()
             console.print(f"[green]Mood changed to: {mood}[/green]")
             continue
         elif user_input.lower() == 'personality':
             personality = select_personality(suggester)
+            suggester.cancel_prefetch()
             console.print(f"[green]Personality changed to: {personality}[/green]")
             continue
         elif user_input.lower() == 'gender':
             gender = select_gender(suggester)
+            suggester.cancel_prefetch()
             console.print(f"[green]Gender preference changed to: {gender}[/green]")
             continue
-        elif user_input.lower() == 'suggestions':
+        elif user_input.lower() in ('suggestions', 'suggestions fresh'):
+            previous_stats = suggester.get_last_call_stats()
             with console.status("[bold blue]Generating suggestions...[/bold blue]"):
-                suggestions = suggester.get_suggestions(person, mood, personality, gender)
-                time.sleep(1)
+                suggestions = suggester.get_suggestions(person, mood, personality, gender, fresh=user_input.lower().endswith('fresh'))
             display_suggestions(suggestions, mood, personality, gender)
+            if suggester.get_last_call_stats() is not previous_stats:
+                print_call_stats(suggester.get_last_call_stats())
             
             # Ask for feedback on each suggestion
             for suggestion in suggestions:
-                if get_user_feedback(suggester, person, suggestion, mood, personality, gender):
+                if get_user_feedback(suggester, person, suggestion["text"], mood, personality, gender):
                     console.print("[green]Feedback saved![/green]")
                 else:
                     console.print("[yellow]Skipping feedback for this suggestion.[/yellow]")
             continue
         elif user_input.lower() == 'history':
-            if person in suggester.conversations and suggester.conversations[person]:
-                console.print("\n[bold]Conversation History:[/bold]")
-                for i, message in enumerate(suggester.conversations[person], 1):
-                    console.print(f"{i}. {message}")
+            total = suggester.conversations.count(person)
+            if total:
+                console.print(f"\n[bold]Conversation History:[/bold] ({total} messages)")
+                # Page through the shard instead of loading the whole history
+                messages = suggester.conversations.iter_records(person)
+                for start in range(0, total, HISTORY_PAGE_SIZE):
+                    for i, message in enumerate(itertools.islice(messages, HISTORY_PAGE_SIZE), start + 1):
+                        console.print(f"{i}. {message}")
+                    if start + HISTORY_PAGE_SIZE < total and not Confirm.ask("Show more?", default=True):
+                        break
             else:
                 console.print("[yellow]No messages in this conversation yet.[/yellow]")
             continue
+        elif user_input.lower() == 'stats':
+            print_stats(suggester)
+            continue
+        elif user_input.lower() == 'cache':
+            if suggester.response_cache is None:
+                console.print("[yellow]Response caching is disabled.[/yellow]")
+            else:
+                stats = suggester.response_cache.stats()
+                console.print(f"[bold]Response cache:[/bold] {stats['entries']} entries, {stats['hits']} hits, {stats['misses']} misses ({stats['hit_rate']:.0%} hit rate)")
+            continue
         elif user_input.lower() == 'chat':
             console.print("\n[bold]Starting chat mode. Type 'back' to return to command mode, 'quit' to end conversation, or 'exit' to quit program.[/bold]")
             while True:
@@ -444,6 +3104,8 @@ def main():
                     break
                 elif chat_input.lower() == 'quit':
                     console.print("[yellow]Ending current conversation...[/yellow]")
+                    suggester.cancel_prefetch()
+                    suggester.flush()
                     person = Prompt.ask("\nWho would you like to chat with?")
                     break
                 elif chat_input.lower() == 'exit':
@@ -453,14 +3115,15 @@ def main():
                 # Add the user's message to the conversation
                 suggester.add_conversation(person, [chat_input])
                 
-                # Generate and display AI response
-                with console.status("[bold blue]Thinking...[/bold blue]"):
-                    response = suggester.chat_with_ai(person, mood, personality, gender)
-                    time.sleep(1)
-                
-                console.print(f"\n[bold blue]AI[/bold blue]: {response}")
+                # Stream the AI response as it is generated
+                previous_stats = suggester.get_last_call_stats()
+                response = stream_chat_response(suggester, person, mood, personality, gender)
+                if suggester.get_last_call_stats() is not previous_stats:
+                    print_call_stats(suggester.get_last_call_stats())
                 # Add the AI's response to the conversation
                 suggester.add_conversation(person, [response])
+                # Suggestions are often asked for next, so start on them now
+                suggester.prefetch_suggestions(person, mood, personality, gender)
             continue
         
         console.print("[yellow]Type 'help' to see available commands or 'chat' to start chatting with the AI.[/yellow]")
@@ -0,0 +1,367 @@
+"""Streaming import of exported chat logs for conversation_suggester.py.
+
+The input is read incrementally, so memory use doesn't grow with its size,
+and messages are appended to the conversation store in batches. Three
+formats are understood:
+
+    text    "Name: message" lines, as in most plain-text exports. A leading
+            "[timestamp]" or "date, time - " is ignored and lines without a
+            sender continue the previous message. The sender is the person
+            the message is filed under, unless --person is given, in which
+            case every message goes to that person and keeps its sender.
+    jsonl   One {"person": ..., "message": ...} object per line ("text" is
+            accepted for "message").
+    json    An array of such objects or of plain strings, or an object
+            mapping each person to an array of messages.
+
+Records that don't name a person go to --person. After every batch is on
+disk the position reached in the input is saved to a checkpoint file, so
+running the same import again after an interruption continues from there.
+
+    python conversation_suggester.py import whatsapp.txt --person Alex
+    python conversation_suggester.py import export.json --batch-size 10000
+"""
+import codecs
+import hashlib
+import json
+import os
+import re
+from typing import Callable, Dict, Optional
+
+from conversation_suggester import ShardedStore, write_atomic
+
+CHUNK_BYTES = 1 << 20
+# Optional "[12/01/2024, 09:15:02] " or "12/01/2024, 09:15 - " prefix, then "Name: message"
+SENDER_LINE = re.compile(
+    r"^(?:\[[^\]]{1,40}\]\s*|\d{1,4}[./-]\d{1,2}[./-]\d{1,4},?\s+\d{1,2}:\d{2}(?::\d{2})?(?:\s?[AaPp]\.?[Mm]\.?)?\s+-\s+)?"
+    r"([^\s:\[\]][^:\[\]]{0,63}?):\s(.*)$"
+)
+WHITESPACE = re.compile(r"[ \t\r\n]*")
+
+def detect_format(path: str) -> str:
+    """Guess the format of an export from its file extension."""
+    extension = os.path.splitext(path)[1].lower()
+    if extension in (".jsonl", ".ndjson"):
+        return "jsonl"
+    return "json" if extension == ".json" else "text"
+
+def message_hash(message: str) -> int:
+    return int.from_bytes(hashlib.blake2b(message.encode("utf-8"), digest_size=8).digest(), "little")
+
+def checkpoint_path(data_dir: str, path: str) -> str:
+    """Get the default checkpoint file for importing path."""
+    digest = hashlib.sha1(os.path.abspath(path).encode("utf-8")).hexdigest()[:8]
+    return os.path.join(data_dir, "imports", f"{os.path.basename(path)}-{digest}.json")
+
+class JSONStream:
+    """Reads a large JSON document one value at a time.
+
+    offset is the byte position in the file of the next unread character, so
+    a stream can be reopened where an earlier one stopped.
+    """
+
+    def __init__(self, f, offset: int = 0):
+        f.seek(offset)
+        self.f = f
+        self.offset = offset
+        self.decoder = codecs.getincrementaldecoder("utf-8")()
+        self.json = json.JSONDecoder()
+        self.buffer = ""
+        self.pos = 0
+        self.eof = False
+
+    def _fill(self) -> bool:
+        """Read the next chunk, returning False at the end of the file."""
+        if self.eof:
+            return False
+        data = self.f.read(CHUNK_BYTES)
+        self.eof = not data
+        self.buffer = self.buffer[self.pos:] + self.decoder.decode(data, final=self.eof)
+        self.pos = 0
+        return True
+
+    def peek(self) -> str:
+        """Skip whitespace and get the next character, or "" at the end of the document."""
+        while True:
+            end = WHITESPACE.match(self.buffer, self.pos).end()
+            self.offset += end - self.pos
+            self.pos = end
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self._fill():
+                return ""
+
+    def expect(self, chars: str) -> str:
+        """Consume the next character, which must be one of chars."""
+        char = self.peek()
+        if not char or char not in chars:
+            raise ValueError(f"Expected {' or '.join(repr(c) for c in chars)} at byte {self.offset}")
+        self.offset += 1  # Structural characters are ASCII
+        self.pos += 1
+        return char
+
+    def value(self):
+        """Decode the next value."""
+        self.peek()
+        while True:
+            try:
+                value, end = self.json.raw_decode(self.buffer, self.pos)
+                # A value ending with the buffer may continue in the next chunk, e.g. a number
+                if end < len(self.buffer) or self.eof:
+                    self.offset += len(self.buffer[self.pos:end].encode("utf-8"))
+                    self.pos = end
+                    return value
+            except json.JSONDecodeError as e:
+                if self.eof:
+                    raise ValueError(f"Invalid JSON at byte {self.offset}: {e.msg}")
+            self._fill()
+
+def iter_json_items(f, state: Dict):
+    """Yield (key, item, state) for each item of a JSON array or of each array in a JSON object.
+
+    key is the object key an item's array belongs to, None for a top-level
+    array. Passing a yielded state back in continues after that item.
+    """
+    stream = JSONStream(f, state.get("offset", 0))
+    resumed = "key" in state
+
+    def array_items(key: Optional[str], resumed: bool):
+        if not resumed:
+            stream.expect("[")
+            if stream.peek() == "]":
+                stream.expect("]")
+                return
+        elif stream.expect(",]") == "]":
+            return
+        while True:
+            item = stream.value()
+            yield key, item, {"offset": stream.offset, "key": key}
+            if stream.expect(",]") == "]":
+                return
+
+    top = ("[" if state["key"] is None else "{") if resumed else stream.peek()
+    if top == "[":
+        yield from array_items(None, resumed)
+        return
+    if top != "{":
+        raise ValueError("Expected a JSON array or object")
+    if resumed:
+        yield from array_items(state["key"], True)
+        if stream.expect(",}") == "}":
+            return
+    else:
+        stream.expect("{")
+        if stream.peek() == "}":
+            return
+    while True:
+        key = stream.value()
+        if not isinstance(key, str):
+            raise ValueError(f"Expected an object key at byte {stream.offset}")
+        stream.expect(":")
+        yield from array_items(key, False)
+        if stream.expect(",}") == "}":
+            return
+
+def record_message(item, person: Optional[str]) -> tuple:
+    """Get (person, message) from a JSON record, either of them None if it has none."""
+    if isinstance(item, str):
+        return person, item
+    if isinstance(item, dict):
+        message = item.get("message", item.get("text"))
+        return item.get("person") or person, message if isinstance(message, str) else None
+    return None, None
+
+def iter_messages(f, fmt: str, person: Optional[str] = None, state: Optional[Dict] = None):
+    """Yield (person, message, state) for each message of an export opened in binary mode.
+
+    state records where the message ends in the input; passing it back in
+    continues with the following message. person or message is None for
+    records that can't be imported.
+    """
+    state = state or {}
+    if fmt == "json":
+        for key, item, item_state in iter_json_items(f, state):
+            yield (*record_message(item, key or person), item_state)
+        return
+    position = state.get("offset", 0)
+    f.seek(position)
+    if fmt == "jsonl":
+        for raw in f:
+            position += len(raw)
+            if not raw.strip():
+                continue
+            try:
+                item = json.loads(raw)
+            except json.JSONDecodeError:
+                item = None
+            yield (*record_message(item, person), {"offset": position})
+        return
+    current = None  # (person, lines) of the message being read
+    for raw in f:
+        line = raw.decode("utf-8", errors="replace").rstrip("\r\n")
+        match = SENDER_LINE.match(line)
+        if match:
+            if current:
+                # Resume at this line, which starts the next message
+                yield current[0], "\n".join(current[1]), {"offset": position}
+            sender, text = match.group(1).strip(), match.group(2)
+            current = (person, [f"{sender}: {text}"]) if person else (sender, [text])
+        elif current:
+            if line.strip():
+                current[1].append(line)
+        elif line.strip():
+            yield None, line, {"offset": position + len(raw)}
+        position += len(raw)
+    if current:
+        yield current[0], "\n".join(current[1]), {"offset": position}
+
+class Deduplicator:
+    """Drops imported messages that are already in a person's history.
+
+    Histories are compared as multisets: the k-th imported copy of a message
+    is dropped if the person had at least k copies of it before the import
+    started. Repeated messages like "ok" are kept, while importing the same
+    export twice, or a newer export containing an older one, adds nothing
+    twice. Only hashes of the existing history not matched yet are held in
+    memory, so re-importing an export frees them as it goes, and done()
+    drops those of a person whose messages have all been read.
+    """
+
+    def __init__(self, store: ShardedStore, base: Optional[Dict[str, int]] = None):
+        self.store = store
+        self.base = base or {}  # person -> records they had before the import
+        self.remaining = {}  # person -> {hash: existing copies not matched yet}
+
+    def is_duplicate(self, person: str, message: str) -> bool:
+        remaining = self.remaining.get(person)
+        if remaining is None:
+            remaining = self.remaining[person] = self._load(person)
+        digest = message_hash(message)
+        copies = remaining.get(digest)
+        if not copies:
+            return False
+        if copies == 1:
+            del remaining[digest]
+        else:
+            remaining[digest] = copies - 1
+        return True
+
+    def done(self, person: str):
+        """Forget a person's unmatched history; any later message of theirs is kept."""
+        if person in self.remaining:
+            self.remaining[person] = {}
+
+    def _load(self, person: str) -> Dict[int, int]:
+        base = self.base.setdefault(person, self.store.count(person))
+        counts = {}
+        for record in self.store.iter_records(person, 0, base):
+            if isinstance(record, str):
+                digest = message_hash(record)
+                counts[digest] = counts.get(digest, 0) + 1
+        return counts
+
+def import_file(suggester, path: str, fmt: str = "auto", person: Optional[str] = None, batch_size: int = 5000,
+                checkpoint_file: Optional[str] = None, restart: bool = False,
+                on_progress: Optional[Callable[[int, Dict, int], None]] = None) -> Dict:
+    """Import the messages of an exported chat log into suggester's conversations.
+
+    Messages are appended per person once batch_size records have been read,
+    then the checkpoint is saved. Unless restart is set, an existing
+    checkpoint for the same input is continued; the part of the input read
+    before is scanned again, without writing anything, to restore which
+    duplicates were already matched, so the checkpoint itself only holds
+    counts per person. on_progress is called with the input bytes consumed,
+    the running totals and the number of records read by this call. Returns
+    the totals: messages imported, duplicates dropped, records skipped and
+    people, plus the records read by this call.
+    """
+    fmt = detect_format(path) if fmt == "auto" else fmt
+    store = suggester.conversations
+    checkpoint = None
+    if checkpoint_file and os.path.exists(checkpoint_file) and not restart:
+        with open(checkpoint_file, 'r') as f:
+            checkpoint = json.load(f)
+        if checkpoint["format"] != fmt or checkpoint["person"] != person:
+            raise ValueError(f"{checkpoint_file} is for an import with --format {checkpoint['format']} and "
+                             f"--person {checkpoint['person']}; use --restart to start over")
+        if os.path.getsize(path) < checkpoint["state"].get("offset", 0):
+            raise ValueError(f"{path} is smaller than when it was partly imported; use --restart to start over")
+    state = checkpoint["state"] if checkpoint else {}
+    totals = checkpoint["totals"] if checkpoint else {"messages": 0, "duplicates": 0, "skipped": 0}
+    written = checkpoint["written"] if checkpoint else {}  # person -> history length after the last saved batch
+    dedup = Deduplicator(store, checkpoint["base"] if checkpoint else None)
+    # Messages of a batch written after the last checkpoint was saved are already stored
+    already = {p: store.count(p) - written.get(p, base) for p, base in dedup.base.items()}
+    batches = {}
+    records = 0
+    section = None  # Person whose array of a JSON object is being read
+
+    def check(message_person: Optional[str], message: Optional[str], state: Dict) -> Optional[bool]:
+        """Classify a message: None to skip it, True if it's a duplicate, False to import it."""
+        nonlocal section
+        if fmt == "json" and state.get("key") != section:
+            # An object's arrays are read one after the other, so the previous person is done
+            if section is not None:
+                dedup.done(section)
+            section = state.get("key")
+        if not message_person or not message:
+            return None
+        return dedup.is_duplicate(message_person, message)
+
+    with open(path, 'rb') as f:
+        if checkpoint:
+            stop = state.get("offset", 0)
+            for message_person, message, item_state in iter_messages(f, fmt, person):
+                if item_state.get("offset", 0) > stop:
+                    break
+                check(message_person, message.strip() if message else message, item_state)
+
+        saved = {"state": state, "totals": dict(totals), "written": dict(written)}
+        saved_people = set(dedup.base)
+
+        def write_checkpoint():
+            write_atomic(checkpoint_file, json.dumps({"input": os.path.abspath(path), "format": fmt, "person": person,
+                                                      **saved, "base": dedup.base}))
+
+        def save(state: Dict):
+            nonlocal saved, saved_people
+            if checkpoint_file:
+                os.makedirs(os.path.dirname(checkpoint_file) or ".", exist_ok=True)
+                if any(p not in saved_people for p in batches):
+                    # Record where new people's histories end before writing to them, so a
+                    # resumed import can tell what this batch already added
+                    write_checkpoint()
+                    saved_people = set(dedup.base)
+            for batch_person, messages in batches.items():
+                store.append(batch_person, messages)
+            suggester.flush()
+            for batch_person in batches:
+                written[batch_person] = store.count(batch_person)
+            batches.clear()
+            saved = {"state": state, "totals": dict(totals), "written": dict(written)}
+            if checkpoint_file:
+                write_checkpoint()
+                saved_people = set(dedup.base)
+            if on_progress:
+                on_progress(state.get("offset", 0), totals, records)
+
+        for message_person, message, state in iter_messages(f, fmt, person, state):
+            records += 1
+            message = message.strip() if message else message
+            duplicate = check(message_person, message, state)
+            if duplicate is None:
+                totals["skipped"] += 1
+            elif duplicate:
+                totals["duplicates"] += 1
+            elif already.get(message_person):
+                already[message_person] -= 1
+                totals["messages"] += 1
+            else:
+                batches.setdefault(message_person, []).append(message)
+                totals["messages"] += 1
+            if records % batch_size == 0:
+                save(state)
+        save(state)
+    if checkpoint_file and os.path.exists(checkpoint_file):
+        os.remove(checkpoint_file)
+    return dict(totals, people=len(dedup.base), read=records, resumed=checkpoint is not None)
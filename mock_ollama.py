@@ -0,0 +1,232 @@
+"""Local stand-in for the Ollama HTTP API, used by the benchmarks.
+
+It implements the endpoints conversation_suggester.py talks to
+(``/api/generate`` and ``/api/chat``, streaming and not, and ``/api/embed``) and
+returns synthetic text, or JSON matching a requested suggestion schema, with
+configurable latency, token rate and response size, so the application can be measured without a GPU or a real model.
+Several servers can be started at once to exercise endpoint pools, with a
+fraction of requests made slow to exercise hedging.
+"""
+import argparse
+import json
+import random
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional
+
+EMBED_DIM = 64
+
+WORDS = (
+    "sure that sounds great how about we talk more about your weekend plans "
+    "maybe ask what they enjoyed most or share a story of your own"
+).split()
+
+def embed(text: str, dim: int = EMBED_DIM) -> list:
+    """Hash each word into a bucket, so texts sharing words get similar vectors."""
+    vector = [0.0] * dim
+    for word in text.lower().split():
+        vector[zlib.crc32(word.encode("utf-8")) % dim] += 1.0
+    return vector
+
+class MockOllamaServer:
+    """Threaded HTTP server answering Ollama API requests with synthetic responses."""
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, latency: float = 0.05,
+                 token_rate: float = 200.0, response_tokens: int = 60, slow_fraction: float = 0.0,
+                 slow_latency: float = 1.0):
+        self.latency = latency  # Seconds before the first token
+        self.slow_fraction = slow_fraction  # Share of requests that wait slow_latency instead
+        self.slow_latency = slow_latency
+        self.random = random.Random(0)
+        self.token_rate = token_rate  # Tokens per second after the first (0 for instant)
+        self.response_tokens = response_tokens
+        self.requests = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.lock = threading.Lock()
+        self.httpd = ThreadingHTTPServer((host, port), self._handler_class())
+        self.httpd.daemon_threads = True
+        self.thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "MockOllamaServer":
+        """Serve requests from a background thread."""
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        """Stop serving and close the socket."""
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def _tokens(self, prompt: str, format=None):
+        rng = random.Random(prompt)
+        # A JSON schema asks for its minItems suggestions, "json" or no format for four
+        schema = format.get("properties", {}).get("suggestions", {}) if isinstance(format, dict) else {}
+        count = schema.get("minItems", 4)
+        lines = []
+        for i in range(count):
+            words = [rng.choice(WORDS) for _ in range(max(1, self.response_tokens // count))]
+            lines.append(f"{' '.join(words).capitalize()}?")
+        if format:
+            text = json.dumps({"suggestions": [{"text": line, "rationale": f"Keeps the {rng.choice(WORDS)} thread going"}
+                                               for line in lines]})
+        else:
+            text = "\n".join(f"{i + 1}. {line}" for i, line in enumerate(lines))
+        # Split into word-sized tokens, keeping whitespace attached
+        tokens = []
+        for part in text.split(" "):
+            tokens.append(part if not tokens else " " + part)
+        return tokens
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            disable_nagle_algorithm = True  # Flush each streamed token immediately
+
+            def log_message(self, format, *args):
+                pass
+
+            def _send_json(self, payload: dict, status: int = 200):
+                data = json.dumps(payload).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_GET(self):
+                if self.path == "/api/version":
+                    self._send_json({"version": "0.0.0-mock"})
+                elif self.path == "/api/tags":
+                    self._send_json({"models": []})
+                else:
+                    self._send_json({"error": "not found"}, 404)
+
+            def do_HEAD(self):
+                self.send_response(200)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                body = json.loads(self.rfile.read(length) or b"{}")
+                with server.lock:
+                    server.requests += 1
+                    server.in_flight += 1
+                    server.max_in_flight = max(server.max_in_flight, server.in_flight)
+                try:
+                    if self.path in ("/api/generate", "/api/chat"):
+                        self._complete(body)
+                    elif self.path == "/api/embed":
+                        inputs = body.get("input", "")
+                        inputs = [inputs] if isinstance(inputs, str) else inputs
+                        self._send_json({"model": body.get("model"), "embeddings": [embed(text) for text in inputs]})
+                    else:
+                        self._send_json({"error": "not found"}, 404)
+                except (BrokenPipeError, ConnectionResetError):
+                    pass  # The client stopped reading, e.g. a cancelled request
+                finally:
+                    with server.lock:
+                        server.in_flight -= 1
+
+            def _complete(self, body: dict):
+                chat = self.path == "/api/chat"
+                if chat:
+                    prompt = "\n".join(m.get("content", "") for m in body.get("messages", []))
+                else:
+                    prompt = body.get("prompt", "")
+                tokens = server._tokens(prompt, body.get("format"))
+                prompt_tokens = max(1, len(prompt) // 4)
+                with server.lock:
+                    slow = server.random.random() < server.slow_fraction
+                time.sleep(server.slow_latency if slow else server.latency)
+                start = time.perf_counter()
+                final = {
+                    "model": body.get("model"),
+                    "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+                    "done": True,
+                    "done_reason": "stop",
+                    "prompt_eval_count": prompt_tokens,
+                    "prompt_eval_duration": int(server.latency * 1e9),
+                    "eval_count": len(tokens)
+                }
+
+                def chunk(token: str, done: bool) -> dict:
+                    part = {"model": body.get("model"), "done": done}
+                    if chat:
+                        part["message"] = {"role": "assistant", "content": token}
+                    else:
+                        part["response"] = token
+                    return part
+
+                if body.get("stream", True) is False:
+                    if server.token_rate > 0:
+                        time.sleep(len(tokens) / server.token_rate)
+                    final["eval_duration"] = max(1, int((time.perf_counter() - start) * 1e9))
+                    final.update(chunk("".join(tokens), True))
+                    self._send_json(final)
+                    return
+
+                self.send_response(200)
+                self.send_header("Content-Type", "application/x-ndjson")
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+                for token in tokens:
+                    if server.token_rate > 0:
+                        time.sleep(1 / server.token_rate)
+                    self._write_chunk(chunk(token, False))
+                final["eval_duration"] = max(1, int((time.perf_counter() - start) * 1e9))
+                final.update(chunk("", True))
+                self._write_chunk(final)
+                self.wfile.write(b"0\r\n\r\n")
+
+            def _write_chunk(self, payload: dict):
+                data = json.dumps(payload).encode("utf-8") + b"\n"
+                self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+                self.wfile.flush()
+
+        return Handler
+
+def main(argv: Optional[list] = None):
+    parser = argparse.ArgumentParser(description="Run a mock Ollama server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11434)
+    parser.add_argument("--latency", type=float, default=0.05, help="Seconds before the first token")
+    parser.add_argument("--token-rate", type=float, default=200.0, help="Tokens per second (0 for instant)")
+    parser.add_argument("--response-tokens", type=int, default=60, help="Approximate tokens per response")
+    parser.add_argument("--slow-fraction", type=float, default=0.0, help="Share of requests that are slow")
+    parser.add_argument("--slow-latency", type=float, default=1.0, help="Seconds before the first token of a slow request")
+    parser.add_argument("--count", type=int, default=1, help="Number of servers, on consecutive ports")
+    args = parser.parse_args(argv)
+    servers = [MockOllamaServer(args.host, args.port + i, args.latency, args.token_rate, args.response_tokens,
+                                args.slow_fraction, args.slow_latency) for i in range(args.count)]
+    for server in servers[1:]:
+        server.start()
+    print(f"Mock Ollama listening on {','.join(server.url for server in servers)}")
+    try:
+        servers[0].httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for server in servers[1:]:
+            server.stop()
+        servers[0].httpd.server_close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,331 @@
+"""Headless HTTP/JSON service for conversation_suggester.py.
+
+All requests share one ConversationSuggester, so conversation shards, the
+feedback database, summaries and the response cache are read once and kept
+warm. Requests that call Ollama run on a bounded pool of worker threads fed
+by a bounded queue; when the queue is full the service answers 503 with a
+Retry-After header instead of piling up work. Turns for the same person run
+one at a time: while one is running, the next ones wait in a per-person
+backlog instead of occupying workers that could serve other people.
+
+    python conversation_suggester.py serve --port 8000 --workers 4 --queue-size 32
+
+Endpoints:
+
+    GET  /health                   service and Ollama status
+    GET  /metrics                  Prometheus text-format metrics
+    GET  /conversations            people with their message count and last activity
+    GET  /conversations/<person>   messages, paged with ?start=&limit=
+    POST /conversations            {"person", "messages"}
+    POST /feedback                 {"person", "suggestion", "feedback", "rating", "mood", "personality", "gender"}
+    POST /suggestions              {"person", "mood", "personality", "gender", "fresh"}
+    POST /chat                     {"person", "message", "mood", "personality", "gender", "fresh"}
+"""
+import json
+import queue
+import re
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, TimeoutError
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, Optional
+from urllib.parse import parse_qs, unquote, urlsplit
+
+from conversation_suggester import ConversationSuggester, console
+
+MAX_BODY_BYTES = 1024 * 1024
+
+class HTTPError(Exception):
+    """An error answered with the given status and a JSON error message."""
+
+    def __init__(self, status: int, message: str, headers: Optional[Dict[str, str]] = None):
+        super().__init__(message)
+        self.status = status
+        self.headers = headers or {}
+
+class SuggesterService:
+    """Runs ConversationSuggester requests on a bounded worker pool."""
+
+    def __init__(self, suggester: ConversationSuggester, workers: int = 4, queue_size: int = 32, timeout: float = 120.0):
+        self.suggester = suggester
+        self.workers = max(1, workers)
+        self.timeout = timeout  # Seconds a client waits for its request to finish
+        self.jobs = queue.Queue()  # Jobs ready to run, at most one per person
+        self.queue_size = max(1, queue_size)
+        self.queued = 0  # Jobs waiting in jobs or in a backlog
+        self.backlogs = {}  # person -> deque of their jobs waiting for the running one
+        self.in_flight = 0
+        self.rejected = 0
+        self.lock = threading.Lock()
+        self.person_locks = {}  # person -> Lock serializing that person's turns
+        self.started = time.time()
+        self.threads = []
+
+    def start(self):
+        """Start the worker threads."""
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._worker, name=f"suggester-worker-{i}", daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def person_lock(self, person: str) -> threading.Lock:
+        with self.lock:
+            lock = self.person_locks.get(person)
+            if lock is None:
+                lock = self.person_locks[person] = threading.Lock()
+            return lock
+
+    def submit(self, func: Callable, *args, person: Optional[str] = None):
+        """Queue func for the worker pool and wait for its result, rejecting it if the queue is full.
+
+        Jobs for a person who already has one queued or running wait in
+        that person's backlog and are queued when it finishes.
+        """
+        future = Future()
+        job = (future, func, args, person)
+        with self.lock:
+            full = self.queued >= self.queue_size
+            if full:
+                self.rejected += 1
+            else:
+                self.queued += 1
+                if person in self.backlogs:
+                    self.backlogs[person].append(job)
+                else:
+                    if person is not None:
+                        self.backlogs[person] = deque()
+                    self.jobs.put(job)
+        if full:
+            self.suggester.metrics.inc("rejected_requests_total")
+            raise HTTPError(503, "Too many requests queued, try again later", {"Retry-After": "1"})
+        try:
+            return future.result(timeout=self.timeout)
+        except TimeoutError:
+            # The worker still finishes the job so the conversation stays consistent
+            raise HTTPError(504, f"Request did not finish within {self.timeout:g}s")
+
+    def _worker(self):
+        while True:
+            future, func, args, person = self.jobs.get()
+            with self.lock:
+                self.queued -= 1
+                self.in_flight += 1
+            try:
+                if future.set_running_or_notify_cancel():
+                    future.set_result(func(*args))
+            except BaseException as e:
+                future.set_exception(e)
+            finally:
+                with self.lock:
+                    self.in_flight -= 1
+                    if person is not None:
+                        backlog = self.backlogs[person]
+                        if backlog:
+                            # Behind the jobs of other people that arrived meanwhile
+                            self.jobs.put(backlog.popleft())
+                        else:
+                            del self.backlogs[person]
+
+    def health(self) -> tuple:
+        """Report the pool state and whether Ollama answers."""
+        try:
+            self.suggester.ollama_client.list()
+            ollama = "ok"
+        except Exception as e:
+            ollama = f"unavailable: {e}"
+        with self.lock:
+            status = {
+                "status": "ok" if ollama == "ok" else "degraded",
+                "ollama": ollama,
+                "model": "auto" if self.suggester.auto_model else self.suggester.model,
+                "workers": self.workers,
+                "in_flight": self.in_flight,
+                "queued": self.queued,
+                "queue_size": self.queue_size,
+                "rejected": self.rejected,
+                "uptime_s": round(time.time() - self.started, 1)
+            }
+        if self.suggester.ollama_pool is not None:
+            status["endpoints"] = self.suggester.ollama_pool.status()
+        return (200 if ollama == "ok" else 503), status
+
+    def _settings(self, body: Dict) -> tuple:
+        """Validate and return the mood, personality and gender of a request."""
+        settings = []
+        for field, default, available in (("mood", "casual", self.suggester.moods),
+                                          ("personality", "ambivert", self.suggester.personality_types),
+                                          ("gender", "any", self.suggester.gender_preferences)):
+            value = body.get(field) or default
+            if value not in available:
+                raise HTTPError(400, f"Unknown {field} '{value}', expected one of: {', '.join(available)}")
+            settings.append(value)
+        return tuple(settings)
+
+    def suggestions(self, body: Dict) -> Dict:
+        person = require(body, "person", str)
+        mood, personality, gender = self._settings(body)
+        if person not in self.suggester.conversations:
+            raise HTTPError(404, f"No conversation with '{person}'")
+        fresh = bool(body.get("fresh", False))
+
+        def run():
+            with self.person_lock(person):
+                model = self.suggester.model_for("suggestions")
+                with self.suggester.metrics.request("get_suggestions", model=model):
+                    return self.suggester._suggest(person, mood, personality, gender, fresh=fresh, model=model)
+
+        return {"person": person, "suggestions": self.submit(run, person=person)}
+
+    def chat(self, body: Dict) -> Dict:
+        person = require(body, "person", str)
+        message = require(body, "message", str)
+        mood, personality, gender = self._settings(body)
+        fresh = bool(body.get("fresh", False))
+
+        def run():
+            with self.person_lock(person):
+                self.suggester.add_conversation(person, [message])
+                model = self.suggester.model_for("chat")
+                with self.suggester.metrics.request("chat_with_ai", model=model, mode=self.suggester.chat_mode):
+                    reply = self.suggester._respond(person, mood, personality, gender, fresh=fresh, model=model)
+                self.suggester.add_conversation(person, [reply])
+                return reply
+
+        return {"person": person, "reply": self.submit(run, person=person)}
+
+    def add_conversation(self, body: Dict) -> Dict:
+        person = require(body, "person", str)
+        messages = require(body, "messages", list)
+        if not all(isinstance(m, str) for m in messages):
+            raise HTTPError(400, "'messages' must be a list of strings")
+        with self.person_lock(person):
+            self.suggester.add_conversation(person, messages)
+            return {"person": person, "count": self.suggester.conversations.count(person)}
+
+    def add_feedback(self, body: Dict) -> Dict:
+        person = require(body, "person", str)
+        suggestion = require(body, "suggestion", str)
+        rating = require(body, "rating", int)
+        if not 1 <= rating <= 5:
+            raise HTTPError(400, "'rating' must be between 1 and 5")
+        mood, personality, gender = self._settings(body)
+        with self.person_lock(person):
+            self.suggester.add_feedback(person, suggestion, str(body.get("feedback", "")), rating, mood, personality, gender)
+        return {"person": person, "saved": True}
+
+    def conversations(self) -> Dict:
+        store = self.suggester.conversations
+        return {"conversations": [{"person": person, "count": store.info(person)["count"],
+                                   "last_activity": store.info(person)["last_activity"]} for person in store.keys()]}
+
+    def conversation(self, person: str, query: Dict) -> Dict:
+        store = self.suggester.conversations
+        if person not in store:
+            raise HTTPError(404, f"No conversation with '{person}'")
+        try:
+            start = int(query.get("start", ["0"])[0])
+            limit = int(query.get("limit", ["100"])[0])
+        except ValueError:
+            raise HTTPError(400, "'start' and 'limit' must be integers")
+        messages = list(store.iter_records(person, max(0, start), max(0, start) + max(0, limit)))
+        return {"person": person, "count": store.count(person), "start": start, "messages": messages}
+
+def require(body: Dict, field: str, kind: type):
+    """Get a required field of the expected type from a request body."""
+    value = body.get(field)
+    # bool is a subclass of int, but true isn't a rating
+    if value is None or not isinstance(value, kind) or (isinstance(value, bool) and kind is not bool) \
+            or (kind is str and not value.strip()):
+        raise HTTPError(400, f"'{field}' is required and must be a {'non-empty string' if kind is str else kind.__name__}")
+    return value
+
+def make_handler(service: SuggesterService):
+    """Build the request handler class bound to service."""
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def _send(self, status: int, payload, headers: Optional[Dict[str, str]] = None, content_type: str = "application/json"):
+            data = payload.encode("utf-8") if isinstance(payload, str) else json.dumps(payload).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(data)))
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(data)
+
+        def _read_body(self) -> Dict:
+            header = (self.headers.get("Content-Length") or "0").strip()
+            if not re.fullmatch(r"[0-9]+", header):
+                # Checked before reading: a negative length would read until the client disconnects
+                raise HTTPError(400, "Content-Length must be a non-negative integer")
+            length = int(header)
+            if length > MAX_BODY_BYTES:
+                raise HTTPError(413, "Request body too large")
+            try:
+                body = json.loads(self.rfile.read(length) or b"{}")
+            except json.JSONDecodeError as e:
+                raise HTTPError(400, f"Invalid JSON: {e}")
+            if not isinstance(body, dict):
+                raise HTTPError(400, "Request body must be a JSON object")
+            return body
+
+        def _dispatch(self, route: Callable):
+            try:
+                result = route()
+                if isinstance(result, tuple):
+                    self._send(*result)
+                else:
+                    self._send(200, result)
+            except HTTPError as e:
+                self._send(e.status, {"error": str(e)}, e.headers)
+            except Exception as e:
+                service.suggester.metrics.inc("errors_total", stage="server")
+                self._send(502, {"error": str(e) or type(e).__name__})
+
+        def do_GET(self):
+            url = urlsplit(self.path)
+            if url.path == "/health":
+                self._dispatch(service.health)
+            elif url.path == "/metrics":
+                self._dispatch(lambda: (200, service.suggester.metrics.to_prometheus(), None, "text/plain; version=0.0.4"))
+            elif url.path == "/conversations":
+                self._dispatch(service.conversations)
+            elif url.path.startswith("/conversations/"):
+                person = unquote(url.path[len("/conversations/"):])
+                self._dispatch(lambda: service.conversation(person, parse_qs(url.query)))
+            else:
+                self._send(404, {"error": "Not found"})
+
+        def do_POST(self):
+            routes = {
+                "/suggestions": service.suggestions,
+                "/chat": service.chat,
+                "/conversations": service.add_conversation,
+                "/feedback": service.add_feedback
+            }
+            route = routes.get(urlsplit(self.path).path)
+            if route is None:
+                self._send(404, {"error": "Not found"})
+                return
+            self._dispatch(lambda: route(self._read_body()))
+
+    return Handler
+
+def serve(suggester: ConversationSuggester, bind: str = "127.0.0.1", port: int = 8000, workers: int = 4,
+          queue_size: int = 32, timeout: float = 120.0):
+    """Serve the HTTP API until interrupted."""
+    service = SuggesterService(suggester, workers, queue_size, timeout)
+    service.start()
+    httpd = ThreadingHTTPServer((bind, port), make_handler(service))
+    httpd.daemon_threads = True
+    console.print(f"[bold blue]Serving on http://{bind}:{httpd.server_address[1]}[/bold blue] "
+                  f"[dim]({service.workers} workers, queue of {service.queue_size}, model {suggester.get_model_info()})[/dim]")
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        console.print("[yellow]Shutting down...[/yellow]")
+    finally:
+        httpd.server_close()
@@ -103,6 +103,12 @@ pull_mistral_model() {
     ollama pull mistral
 }
 
+# Function to pull the embedding model used to find related messages
+pull_embedding_model() {
+    print_status "Pulling nomic-embed-text embedding model..."
+    ollama pull nomic-embed-text
+}
+
 # Main setup process
 print_status "Starting setup process..."
 
@@ -137,6 +143,7 @@ fi
 
 # Pull Mistral model
 pull_mistral_model
+pull_embedding_model
 
 # Initialize Rye project if not already initialized
 if [ ! -f "pyproject.toml" ]; then
@@ -0,0 +1,127 @@
+import json
+import os
+
+import pytest
+
+from conversation_suggester import ConversationSuggester
+from importer import checkpoint_path, import_file
+from mock_ollama import MockOllamaServer
+
+EXISTING = {"Alex": ["hi", "how are you", "ok"], "Sam": ["hey"]}
+
+# The export starts with what's already stored; the later "ok" and "hey" are new messages
+RECORDS = ([("Alex", "hi"), ("Alex", "how are you"), ("Alex", "ok")]
+           + [("Alex", f"message {i}") for i in range(12)]
+           + [("Alex", "ok")]
+           + [("Sam", "hey")]
+           + [("Sam", f"reply {i}") for i in range(9)]
+           + [("Sam", "hey")]
+           + [("Jo", f"note {i}") for i in range(7)])
+
+class Interrupted(Exception):
+    pass
+
+@pytest.fixture(scope="module")
+def server():
+    with MockOllamaServer() as server:
+        yield server
+
+def write_export(directory: str, fmt: str) -> str:
+    path = os.path.join(directory, f"export.{fmt}")
+    if fmt == "jsonl":
+        text = "".join(json.dumps({"person": p, "message": m}) + "\n" for p, m in RECORDS)
+    elif fmt == "json":
+        people = {}
+        for p, m in RECORDS:
+            people.setdefault(p, []).append(m)
+        text = json.dumps(people, indent=2)
+    else:
+        text = "".join(f"{p}: {m}\n" for p, m in RECORDS)
+    with open(path, 'w') as f:
+        f.write(text)
+    return path
+
+def new_suggester(data_dir: str, server: MockOllamaServer) -> ConversationSuggester:
+    suggester = ConversationSuggester(data_dir=data_dir, host=server.url, cache_size=0, retrieve_k=0,
+                                      prefetch=False, preload=False)
+    for person, messages in EXISTING.items():
+        if person not in suggester.conversations:
+            suggester.add_conversation(person, messages)
+    suggester.flush()
+    return suggester
+
+def histories(suggester: ConversationSuggester) -> dict:
+    store = suggester.conversations
+    return {person: list(store.iter_records(person)) for person in store}
+
+def run_import(data_dir: str, server: MockOllamaServer, path: str, fmt: str, on_progress=None):
+    suggester = new_suggester(data_dir, server)
+    try:
+        return import_file(suggester, path, fmt, batch_size=5, checkpoint_file=checkpoint_path(data_dir, path),
+                           on_progress=on_progress), histories(suggester)
+    finally:
+        suggester.close()
+
+def expected(tmp_path, server: MockOllamaServer, fmt: str):
+    """Import the export without interruptions, for comparison."""
+    return run_import(str(tmp_path / "reference"), server, write_export(str(tmp_path), fmt), fmt)
+
+@pytest.mark.parametrize("fmt", ["jsonl", "json", "text"])
+def test_uninterrupted_import_drops_existing_messages(tmp_path, server, fmt):
+    totals, result = expected(tmp_path, server, fmt)
+    assert result["Alex"] == EXISTING["Alex"] + [f"message {i}" for i in range(12)] + ["ok"]
+    assert result["Sam"] == ["hey"] + [f"reply {i}" for i in range(9)] + ["hey"]
+    assert result["Jo"] == [f"note {i}" for i in range(7)]
+    assert (totals["messages"], totals["duplicates"]) == (len(RECORDS) - 4, 4)
+
+@pytest.mark.parametrize("fmt", ["jsonl", "json", "text"])
+@pytest.mark.parametrize("interrupt_at", [1, 3, 6])
+def test_interrupted_import_resumes_without_duplicates(tmp_path, server, fmt, interrupt_at):
+    reference_totals, reference = expected(tmp_path, server, fmt)
+    data_dir = str(tmp_path / "data")
+    path = write_export(str(tmp_path), fmt)
+    calls = 0
+
+    def interrupt(offset, totals, records):
+        nonlocal calls
+        calls += 1
+        if calls == interrupt_at:
+            raise Interrupted()
+
+    with pytest.raises(Interrupted):
+        run_import(data_dir, server, path, fmt, on_progress=interrupt)
+    assert os.path.exists(checkpoint_path(data_dir, path))
+
+    totals, result = run_import(data_dir, server, path, fmt)
+    assert totals["resumed"]
+    assert result == reference
+    assert {k: totals[k] for k in ("messages", "duplicates", "skipped")} == \
+        {k: reference_totals[k] for k in ("messages", "duplicates", "skipped")}
+    assert not os.path.exists(checkpoint_path(data_dir, path))
+
+@pytest.mark.parametrize("fmt", ["jsonl", "json"])
+def test_batch_written_before_checkpoint_is_not_written_again(tmp_path, server, fmt, monkeypatch):
+    reference_totals, reference = expected(tmp_path, server, fmt)
+    data_dir = str(tmp_path / "data")
+    path = write_export(str(tmp_path), fmt)
+    suggester = new_suggester(data_dir, server)
+    flush = suggester.flush
+    calls = 0
+
+    def flush_then_crash():
+        # The third batch reaches the shards but its checkpoint is never saved
+        nonlocal calls
+        flush()
+        calls += 1
+        if calls == 3:
+            raise Interrupted()
+
+    monkeypatch.setattr(suggester, "flush", flush_then_crash)
+    with pytest.raises(Interrupted):
+        import_file(suggester, path, fmt, batch_size=5, checkpoint_file=checkpoint_path(data_dir, path))
+    suggester.close()
+
+    totals, result = run_import(data_dir, server, path, fmt)
+    assert totals["resumed"]
+    assert result == reference
+    assert totals["messages"] == reference_totals["messages"]
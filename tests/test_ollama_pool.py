@@ -0,0 +1,119 @@
+import socket
+import threading
+import time
+
+import pytest
+from ollama import Client
+
+from conversation_suggester import OllamaPool
+from mock_ollama import MockOllamaServer
+
+def free_port() -> int:
+    """Get a port nothing is listening on."""
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def dead_url() -> str:
+    return f"http://127.0.0.1:{free_port()}"
+
+def wait_for(condition, timeout: float = 5.0) -> bool:
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if condition():
+            return True
+        time.sleep(0.02)
+    return condition()
+
+@pytest.fixture
+def servers():
+    started = []
+
+    def start(**kwargs) -> MockOllamaServer:
+        server = MockOllamaServer(**kwargs).start()
+        started.append(server)
+        return server
+
+    yield start
+    for server in started:
+        server.stop()
+
+def test_acquire_prefers_fewest_outstanding(servers):
+    first, second = servers(), servers()
+    pool = OllamaPool([first.url, second.url], health_interval=0)
+    a = pool.acquire()
+    b = pool.acquire()
+    assert a is not b
+    # b keeps one request in flight, so a is picked whenever it has none
+    for _ in range(3):
+        pool.release(a)
+        assert pool.acquire() is a
+    assert [e["outstanding"] for e in pool.status()] == [1, 1]
+
+def test_concurrent_calls_spread_over_endpoints(servers):
+    first, second = servers(latency=0.2), servers(latency=0.2)
+    pool = OllamaPool([first.url, second.url], health_interval=0)
+    threads = [threading.Thread(target=pool.generate, kwargs={"model": "m", "prompt": f"hi {i}"}) for i in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert (first.requests, second.requests) == (2, 2)
+    assert first.max_in_flight == second.max_in_flight == 2
+
+def test_failing_endpoint_is_ejected_then_readmitted_after_eject_seconds(servers):
+    live = servers(token_rate=0)
+    pool = OllamaPool([dead_url(), live.url], health_interval=0, max_failures=2, eject_seconds=1.0)
+    dead = pool.endpoints[0]
+    for i in range(4):
+        pool.generate(model="m", prompt=f"hi {i}")
+    assert dead.failures == 2
+    assert not pool.status()[0]["healthy"]
+
+    # Ejected: calls no longer try it
+    tried = dead.requests
+    for i in range(4):
+        pool.generate(model="m", prompt=f"again {i}")
+    assert dead.requests == tried
+
+    time.sleep(1.1)
+    assert pool.status()[0]["healthy"]
+    pool.generate(model="m", prompt="first")
+    pool.generate(model="m", prompt="second")
+    assert dead.requests > tried
+
+def test_ejected_endpoint_is_readmitted_by_health_check(servers):
+    live = servers()
+    port = free_port()
+    pool = OllamaPool([f"http://127.0.0.1:{port}", live.url], health_interval=0.1, max_failures=1,
+                      eject_seconds=60)
+    assert wait_for(lambda: not pool.status()[0]["healthy"])
+    servers(port=port)
+    assert wait_for(lambda: pool.status()[0]["healthy"])
+    assert pool.endpoints[0].failures == 0
+
+def test_failover_before_first_chunk(servers):
+    live = servers(token_rate=0)
+    expected = "".join(chunk["response"] for chunk in Client(host=live.url).generate(model="m", prompt="hi", stream=True))
+    pool = OllamaPool([dead_url(), live.url], health_interval=0, max_failures=10)
+    dead = pool.endpoints[0]
+    for _ in range(2):
+        chunks = list(pool.generate(model="m", prompt="hi", stream=True))
+        assert "".join(chunk["response"] for chunk in chunks) == expected
+        assert chunks[-1]["done"]
+    # Ties rotate, so the unreachable endpoint was picked first at least once
+    assert dead.requests >= 1
+    assert dead.failures == dead.requests
+
+def test_hedge_wins_against_slow_endpoint(servers):
+    slow = servers(slow_fraction=1.0, slow_latency=2.0)
+    fast = servers(latency=0.01, token_rate=0)
+    pool = OllamaPool([slow.url, fast.url], hedge_after=0.1, health_interval=0)
+    start = time.perf_counter()
+    response = pool.generate(model="m", prompt="hi")
+    elapsed = time.perf_counter() - start
+    assert response["done"]
+    assert response["response"] == Client(host=fast.url).generate(model="m", prompt="hi")["response"]
+    assert elapsed < 1.0
+    assert (slow.requests, fast.requests) == (1, 2)
+    assert (pool.hedges, pool.hedge_wins) == (1, 1)
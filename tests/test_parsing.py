@@ -0,0 +1,85 @@
+import json
+
+import pytest
+
+from conversation_suggester import ConversationSuggester, clean_suggestion_text, repair_json, split_suggestion_lines
+from mock_ollama import MockOllamaServer
+
+SUGGESTIONS = {"suggestions": [{"text": "Ask about the trip", "rationale": "They mentioned it"},
+                               {"text": "Share a story", "rationale": "Keeps it balanced"}]}
+
+@pytest.mark.parametrize("text", [
+    "```json\n" + json.dumps(SUGGESTIONS) + "\n```",
+    "Here you go:\n" + json.dumps(SUGGESTIONS) + "\nHope that helps!",
+    json.dumps(SUGGESTIONS)[:-2] + ",]}",
+])
+def test_repair_json_recovers_wrapped_json(text):
+    assert repair_json(text) == (SUGGESTIONS, False)
+
+def test_repair_json_closes_truncated_json():
+    text = json.dumps(SUGGESTIONS)
+    data, truncated = repair_json(text[:text.index("Share a") + 5])
+    assert truncated
+    assert data["suggestions"][0] == SUGGESTIONS["suggestions"][0]
+    assert data["suggestions"][1]["text"] == "Share"
+
+def test_repair_json_salvages_text_fields():
+    text = '{"suggestions": [{"text": "Say \\"hi\\"", "rationale": oops}, {"text": "Wave"} }'
+    assert repair_json(text) == ([{"text": 'Say "hi"'}, {"text": "Wave"}], False)
+
+def test_repair_json_without_json():
+    assert repair_json("Sure, ask how their day went.") == (None, False)
+
+def test_split_suggestion_lines_takes_list_items_and_their_continuations():
+    response = ("Here are some ideas:\n"
+                "1. Ask how the trip went\n"
+                "   and what they liked most\n"
+                "2) Share your weekend\n"
+                "- Suggest a walk\n"
+                "\n"
+                "Let me know if you want more!")
+    assert split_suggestion_lines(response) == ["Ask how the trip went and what they liked most",
+                                                "Share your weekend", "Suggest a walk"]
+
+def test_split_suggestion_lines_without_list_uses_lines():
+    response = "Here are some suggestions:\nAsk about work\n\n  Tell a joke  \n"
+    assert split_suggestion_lines(response) == ["Ask about work", "Tell a joke"]
+
+@pytest.mark.parametrize("text, cleaned", [
+    ('"Hello there"', "Hello there"),
+    ("“Hello there”", "Hello there"),
+    ('Just say "I\'d love to hear more"', 'Just say "I\'d love to hear more"'),
+    ('"Hi" and then "bye"', '"Hi" and then "bye"'),
+    ('**"Hi!"**', "Hi!"),
+    ('"**Hi!**"', "Hi!"),
+    ("__Sounds great__", "Sounds great"),
+    ("That was **really** fun", "That was really fun"),
+    ("Use __init__ carefully", "Use __init__ carefully"),
+    ("__init__", "__init__"),
+    ("Use **kwargs and 2**10", "Use **kwargs and 2**10"),
+])
+def test_clean_suggestion_text(text, cleaned):
+    assert clean_suggestion_text(text) == cleaned
+
+@pytest.fixture
+def suggester(tmp_path):
+    with MockOllamaServer() as server:
+        suggester = ConversationSuggester(data_dir=str(tmp_path), host=server.url, prefetch=False, preload=False)
+        yield suggester
+        suggester.close()
+
+def test_parse_suggestions_keeps_inner_quotes_and_names(suggester):
+    response = json.dumps({"suggestions": [
+        {"text": 'Just say "I\'d love to hear more"', "rationale": "Shows interest"},
+        {"text": "Use __init__ carefully", "rationale": "Python tip"},
+        {"text": '"Sounds fun!"', "rationale": "Quoted"},
+    ]})
+    assert [s["text"] for s in suggester._parse_suggestions(response)] == [
+        'Just say "I\'d love to hear more"', "Use __init__ carefully", "Sounds fun!"]
+
+def test_parse_suggestions_drops_duplicates_after_cleaning(suggester):
+    response = "1. **Ask about the trip**\n2. \"Ask about the trip!\"\n3. Share a story"
+    assert [s["text"] for s in suggester._parse_suggestions(response)] == ["Ask about the trip", "Share a story"]
+
+def test_parse_suggestions_returns_none_for_invalid_json_without_fallback(suggester):
+    assert suggester._parse_suggestions('{"suggestions": [{"rationale": "no text"}]}', fallback=False) is None